@@ -21,18 +21,19 @@
 
 import sys
 import os
-import json
+import ssm_json
 import re
 import ntpath
+from ssm_graph import SSMGraph
 
+NODE_ID_INDEX = 1  # position for NodeID column in CBLM
+CODE_INDEX = 4     # position for Code column in CBLM
 
-def add_codes_to_single_ssm(ssm, cblm, cssm_dir):
-    with open(ssm) as json_input_file:
-        json_object = json.load(json_input_file)
-
-    nodes = json_object["nodes"]
-    print 'ssm: ' + ssm + '; cblm: ' + cblm + "; " + str(len(nodes)) + " nodes"
 
+def read_cblm(cblm):
+    """ Read a CBLM file as a list of rows, each a list of tab-separated items,
+        headers included.
+    """
     with open(cblm) as cblm_file: # Read CBLM file as list, each item a row:
         rows = cblm_file.read().split("\n");
 
@@ -41,24 +42,44 @@ def add_codes_to_single_ssm(ssm, cblm, cssm_dir):
         r = row.split("\t") # Split each row into a list of items
         clist.append(r)
     clist.pop() # get rid of empty last row
+    return clist
 
-    node_id_index = 1 # position for NodeID column in CBLM
-    code_index = 4    # position for Code column in CBLM
 
+def add_codes_to_ssm(ssm, clist, graph=None):
+    """ Add to each node of an SSM dict the code for it in a CBLM.
+
+        Args:
+            ssm: an SSM dict; its nodes are changed in place.
+            clist: the rows of the CBLM (see read_cblm).
+            graph (optional): the SSMGraph of ssm, if the caller has one.
+
+        Returns:
+            the SSM dict.
+    """
+    if graph is None:
+        graph = SSMGraph(ssm)
     for c_node_line in clist[1:]: # Skipping headers, select each row
-        # Find which node in json object nodes has the same id  as the NodeID in
-	# the current c_node_line:
-	for j_ix, j_node in enumerate(nodes): # Look at each node in json object
-	    if str(j_node["id"]) == c_node_line[node_id_index]:
-		j_node["code"] = c_node_line[code_index] # Add matching code
-		break
+        # Find the (first) node in the ssm that has the same id as the NodeID
+        # in the current c_node_line:
+        ix = graph.index_of_text(c_node_line[NODE_ID_INDEX])
+        if ix is not None:
+            graph.set_code(ix, c_node_line[CODE_INDEX]) # Add matching code
+    return ssm
+
+
+def add_codes_to_single_ssm(ssm, cblm, cssm_dir):
+    json_object = ssm_json.load(ssm)
+
+    nodes = json_object["nodes"]
+    print 'ssm: ' + ssm + '; cblm: ' + cblm + "; " + str(len(nodes)) + " nodes"
+
+    add_codes_to_ssm(json_object, read_cblm(cblm))
 
     # Finally, write the json object with codes added to file:
     outfilename = (cssm_dir + "/" + os.path.splitext(ntpath.basename(ssm))[0]
-	        + "-C.json")
+                   + "-C.json")
     print outfilename
-    with open(outfilename, "w") as outfile:
-	json.dump(json_object, outfile)
+    ssm_json.dump(json_object, outfilename)
 
 
 def main():
@@ -13,6 +13,7 @@
 
     Usage:
         add_rlabels_to_SSMs.py indir outdir [use_full_filename] [undir]
+                               [plain_names]
 
     Args:
         indir: String path to a directory of System Support Map (SSM) files.
@@ -29,14 +30,37 @@
         undir (optional): Boolean. if True, use an undirected graph traversal.
             Otherwise, consider edge directionality when traversing
             Responsibility subgraphs. Default is False (directed).
+        plain_names (optional): Boolean. If true, leave node names as they
+            are and record rlabels only in each node's "rlabels" list; the SSM
+            gets a top-level "rlabelsInNames": false, so that later stages
+            know not to parse names. Default is False: append " " + rlabel to
+            the name of the node for each of its rlabels, as ever.
+            Never pass plain-names output to blm.R: it takes the rlabels from
+            the node names, so its BLMs would have none, and Stage 2
+            (rlabels2rcodes.py) would find no rcodes for them.
 """
 
 import sys
 import os
-import json
 import re
 import ntpath
-import Queue
+import collections
+import itertools
+import numpy as np
+import ssm_json
+from ssm_graph import SSMGraph, RECTANGLE
+
+# Bits per word of the per-node responsibility bitsets:
+WORD_BITS = 64
+
+# Top-level SSM key that is false if rlabels are not appended to node names:
+RLABELS_IN_NAMES_KEY = "rlabelsInNames"
+
+# How SSMs are rlabeled: the use_full_filename, undir and plain_names options
+# of the command line (see module docstring). Callers that import this module
+# pass their own, rather than set its globals:
+RlabelOptions = collections.namedtuple(
+    "RlabelOptions", ["use_full_filename", "undir", "plain_names"])
 
 
 def print_node(n):
@@ -47,27 +71,14 @@ def print_node(n):
         print None
 
 
-def print_nodes(nodes, num):
+def print_nodes(graph, num):
     for i in range(0, num):
-        n = get_node(i, nodes)
+        ix = graph.index_of(i)
+        n = None if ix is None else graph.nodes[ix]
         print "------\nnode #" + str(i)
         print_node(n)
 
 
-def convert(input):
-    """ Convenience function to convert from unicode to ascii for easier
-        reading of diagnostic output. From https://stackoverflow.com/questions/13101653/python-convert-complex-dictionary-of-strings-from-unicode-to-ascii
-    """
-    if isinstance(input, dict):
-        return {convert(key): convert(value) for key, value in input.iteritems()}
-    elif isinstance(input, list):
-        return [convert(element) for element in input]
-    elif isinstance(input, unicode):
-        return input.encode('utf-8')
-    else:
-        return input
-
-
 def get_file_list(dir, suffix):
     """ Get a list of all the files (in "dir") whose names end in "suffix."
     Args:
@@ -136,27 +147,20 @@ def get_role(nodes):
     return None
 
 
-def init_visitation(nodes, responsibilities):
-    mark_nodes_unvisited(nodes)
-    """ 2018/06/12: Now that we're rcoding, we want Roles to get rlabels, too.
-    role = get_role(nodes)
-    if role is not None:
-        role["visited"] = True
+def get_responsibilities(graph):
+    """ The indices of the Responsibility nodes of an SSMGraph, in order.
     """
-    for r in responsibilities:
-        r["visited"] = True
+    # if n["type"] == "responsibility":
+    return graph.nodes_with_shape(RECTANGLE)
 
 
-def get_responsibilities(nodes):
-    responsibilities = []
-    for n in nodes:
-        # if n["type"] == "responsibility":
-        if n["shape"] == "rectangle":
-            responsibilities.append(n)
-    return responsibilities
+def get_options():
+    """ The RlabelOptions set from the command line by main().
+    """
+    return RlabelOptions(use_full_filename, undir, plain_names)
 
 
-def build_rlabel(fname, r_id):
+def build_rlabel(fname, r_id, options=None):
     """ The several scripts that extract SSMs from the database build filenames
         that incorporate the SSM's database id into the filename. If that id is
         present in the filename we'd like to use it (for clarity and
@@ -169,205 +173,276 @@ def build_rlabel(fname, r_id):
         fname: the name of the current SSM file in which the Responsibility
             node currently of interest is to be found.
         r_id: the integer id of that Responsibility node in that SSM.
+        options (optional): the RlabelOptions; by default, get_options().
 
     Returns:
         an "rlabel" string
     """
-    if use_full_filename:
+    if options is None:
+        options = get_options()
+    if options.use_full_filename:
         basename = os.path.basename(fname)
         base = os.path.splitext(basename)[0]
-        return "[r" + str(r_id) + "-" + base + "]"
+        return "[r" + str(r_id) + "-" + ssm_json.text(base) + "]"
     else:
         ssm_id = re.findall(r'\d+', fname)[-1]
         return "[r" + str(r_id) + "-" + ssm_id + "]"
 
 
-def get_node(id, nodes):
-    for n in nodes:
-        if n["id"] == id:
-            return n
-    return None
+def build_outpath(inpath):
+    split_inpath = inpath.rsplit('.', 1)
+    return split_inpath[0] + "-rlabeled.json"
 
 
-def get_targets_of(n, links, nodes):
-    targets = []
-    for l in links:
-        if l["source"] == n["id"]:
-            targets.append(get_node(l["target"], nodes))
-    return targets
+def init_bitsets(graph, responsibilities, adjacency, is_resp):
+    """ Create one bitset per node, with one bit per responsibility, holding
+        the first step of every traversal: bit k is set for responsibility k
+        itself. A responsibility whose id is also that of an earlier node
+        (and so has no links of its own, see SSMGraph) also sets its bit in
+        its first successors.
 
+        Args:
+            graph: the SSMGraph of the current SSM.
+            responsibilities: the indices of its responsibility nodes.
+            adjacency: the successors of each node (e.g.,
+                SSMGraph.target_lists()).
+            is_resp: bool array, True for responsibility nodes.
 
-def get_sources_of(n, links, nodes):
-    sources = []
-    for l in links:
-        if l["target"] == n["id"]:
-            sources.append(get_node(l["source"], nodes))
-    return sources
+        Returns:
+            a (nodes, words) array of uint64 words.
+    """
+    words = (len(responsibilities) + WORD_BITS - 1) // WORD_BITS
+    bits = np.zeros((len(graph), words), dtype=np.uint64)
+    for k, r in enumerate(responsibilities):
+        bit = np.uint64(1 << (k % WORD_BITS))
+        bits[r, k // WORD_BITS] |= bit
+        if graph.canonical[r] != r:
+            for t in adjacency[r]:
+                if not is_resp[t]:
+                    bits[t, k // WORD_BITS] |= bit
+    return bits
+
+
+def propagate_bitsets(bits, src, tgt, is_resp):
+    """ Propagate the bitsets of all nodes along links src -> tgt, all
+        responsibilities at once and a word at a time, until nothing changes.
+        No bits are propagated into a responsibility node, so that each
+        traversal stops at the positions of the other responsibilities in the
+        graph. On each round only links from nodes that changed are followed.
 
+        Args:
+            bits: see init_bitsets; updated in place.
+            src, tgt: int arrays of the node indices of the ends of each link
+                (-1 for an unknown node), in the direction of traversal.
+            is_resp: bool array, True for responsibility nodes.
 
-def build_outpath(inpath):
-    split_inpath = inpath.rsplit('.', 1)
-    return split_inpath[0] + "-rlabeled.json"
+        Returns:
+            bits.
+    """
+    keep = (src >= 0) & (tgt >= 0)
+    keep[keep] = ~is_resp[tgt[keep]]
+    src = src[keep]
+    tgt = tgt[keep]
+    changed = bits.any(axis=1)
+    while True:
+        live = changed[src]
+        if not live.any():
+            return bits
+        s = src[live]
+        t = tgt[live]
+        before = bits[t]
+        np.bitwise_or.at(bits, t, bits[s])
+        changed = np.zeros(len(bits), dtype=bool)
+        changed[t[(bits[t] != before).any(axis=1)]] = True
+
+
+def unpack_bitsets(bits, n_bits):
+    """ Turn bitsets into a (nodes, n_bits) bool array.
+    """
+    one = np.uint64(1)
+    return np.array([(bits[:, k // WORD_BITS] >> np.uint64(k % WORD_BITS)) &
+                     one for k in range(n_bits)], dtype=bool).T
 
 
-def traverse_rgraph(links, nodes, r, responsibilities, fname):
-    """ For a given responsibility node r traverse the *directed* subgraph of
-        nodes that are connected to r, marking each as visited and appending
-        the appropriate rlabel to each of those connected nodes' "name" field.
+def append_rlabels(n, rlabels, plain_names):
+    """ Add rlabels to node n: to its "rlabels" list and, unless plain_names
+        is True, to the end of its "name", each preceded by a space.
+    """
+    n["rlabels"].extend(rlabels)
+    if not plain_names:
+        n["name"] = " ".join([n["name"]] + rlabels)
 
-        See http://www.cs.cornell.edu/courses/cs2112/2012sp/lectures/lec24/lec24-12sp.html: "Breadth-first search"
 
-        frontier = new Queue()
-        mark root visited (set root.distance = 0)
-        frontier.push(root)
-        while frontier not empty {
-            Vertex v = frontier.pop()
-            for each successor v' of v {
-                if v' unvisited {
-                    frontier.push(v')
-                    mark v' visited (v'.distance = v.distance + 1)
-                }
-            }
-        }
+def rlabel_directed(graph, responsibilities, rlabels, plain_names=False):
+    """ Rlabel the nodes of an SSM with every responsibility at once. Each
+        responsibility's rlabel goes to itself and to every node it reaches
+        by following links forward, and then to every node it reaches by
+        following them backward that doesn't have it yet, without passing
+        through another responsibility. This is done with one forward and
+        one backward propagation of per-node responsibility bitsets (see
+        propagate_bitsets), rather than two breadth-first traversals per
+        responsibility.
 
-    Args:
-        links: the links sub-dict from the current SSM.
-        nodes: the nodes sub-dict from the current SSM.
-        r: the responsbility node whose subgraph we're traversing.
-            responsibilities: list of responsibility nodes: all need to be
-            marked as visited to terminate traversal at their positions in the
-            graph.
-        fname: name of the SSM file from which these various elements have been
-            extracted.
+        Args:
+            graph: the SSMGraph of the current SSM.
+            responsibilities: the indices of its responsibility nodes, in
+                order.
+            rlabels: the rlabel of each responsibility.
+            plain_names: see append_rlabels.
 
-    Returns:
-        None
+        Returns:
+            a bool array: the nodes reached backward from the last
+            responsibility (which add_rlabels_to_ssm marks as "visited", with
+            the responsibilities, as rlabeling always has).
     """
-    r_id = r["id"]
-    rlabel = build_rlabel(fname, r_id)
-    init_visitation(nodes, responsibilities)
-    init_rlabel_lists(nodes)
+    nodes = graph.nodes
+    is_resp = graph.shape == RECTANGLE
+    forward = init_bitsets(graph, responsibilities, graph.target_lists(),
+                           is_resp)
+    propagate_bitsets(forward, graph.src, graph.tgt, is_resp)
+    backward = init_bitsets(graph, responsibilities, graph.source_lists(),
+                            is_resp)
+    propagate_bitsets(backward, graph.tgt, graph.src, is_resp)
+    forward = unpack_bitsets(forward, len(responsibilities))
+    backward = unpack_bitsets(backward, len(responsibilities))
+    # Apply each node's rlabels in the order of the responsibilities, the
+    # backward ones only if they aren't already there:
+    ixs, ks = np.nonzero(forward | backward)  # by node, then by rlabel
+    hits = zip(ixs.tolist(), ks.tolist(), forward[ixs, ks].tolist(),
+               backward[ixs, ks].tolist())
+    for i, node_hits in itertools.groupby(hits, lambda hit: hit[0]):
+        n = nodes[i]
+        present = set(n["rlabels"])
+        added = []
+        for i, k, fwd, bwd in node_hits:
+            rlabel = rlabels[k]
+            if fwd or (bwd and rlabel not in present):
+                added.append(rlabel)
+                present.add(rlabel)
+        append_rlabels(n, added, plain_names)
+    return backward[:, -1]
+
+
+def rlabel_undirected(graph, responsibilities, rlabels, plain_names=False):
+    """ Rlabel the nodes of an SSM as though all links are undirected, with
+        every responsibility at once. Each responsibility's rlabel goes to
+        itself and to every node it reaches over links in either direction
+        without passing through another responsibility, in the order of the
+        responsibilities.
+
+        With responsibility nodes as barriers, the nodes reached from a
+        responsibility are itself plus every component (see
+        SSMGraph.components) that one of its neighbors belongs to. So the
+        components are found once, each gets the rlabels of the
+        responsibilities it touches, in order, and each node gets the rlabels
+        of its component.
 
-    q = Queue.Queue()
-    q.put(r)
-    while not q.empty():
-        n = q.get()
-        newname = n["name"] + " " + rlabel
-        n["name"] = newname
-        n["rlabels"].append(rlabel)
-        targets = get_targets_of(n, links, nodes)
-        for t in targets:
-            if not t["visited"]:
-                t["visited"] = True
-                q.put(t)
-
-    # Note: this approach isolates the source-to-target links from the target-
-    # to-source links, i.e., it doesn't identify connectivity via the
-    # combination, e.g., node[a] -> node[b] <- node[c]: node[a] is connected to
-    # node[c] but this won't find it. We need to convert the directed node
-    # representation to an undirected equivalent if the latter is what we wish
-    # to capture.
-    init_visitation(nodes, responsibilities)
-    q.put(r)
-    while not q.empty():
-        n = q.get()
-        if rlabel not in n["rlabels"]:  # avoid duplicating rlabels
-            newname = n["name"] + " " + rlabel
-            n["name"] = newname
-            n["rlabels"].append(rlabel)
-        sources = get_sources_of(n, links, nodes)
-        for s in sources:
-            if not s["visited"]:
-                s["visited"] = True
-                q.put(s)
-
-
-def traverse_undirected_rgraph(links, nodes, r, responsibilities, fname):
-    """ Traverse the subgraph with r at its root as though all links are
-        undirected.
-
-    2do: This has turned out to be mostly a duplicate of the traverse_rgraph
-        function with undirlinks added, so if we want to keep it we should
-        merge the two and eliminate a bunch of copied-and-pasted code.
+        Args:
+            graph: the SSMGraph of the current SSM.
+            responsibilities: the indices of its responsibility nodes, in
+                order.
+            rlabels: the rlabel of each responsibility.
+            plain_names: see append_rlabels.
 
-    Args:
-        links: the links sub-dict from the current SSM.
-        nodes: the nodes sub-dict from the current SSM.
-        r: the responsbility node whose subgraph we're traversing.
-            responsibilities: list of responsibility nodes: all need to be
-                marked as "visited."
-        fname: name of the SSM file from which these various elements have
-                been extracted.
+        Returns:
+            a set of the nodes reached from the last responsibility (which
+            add_rlabels_to_ssm marks as "visited", with the responsibilities,
+            as rlabeling always has).
+    """
+    nodes = graph.nodes
+    is_resp = graph.shape == RECTANGLE
+    component = graph.components(is_resp)
+    is_resp = is_resp.tolist()
+    neighbors = graph.neighbor_lists()
+    component_rlabels = collections.defaultdict(list)
+    for r, rlabel in zip(responsibilities, rlabels):
+        # A responsibility is a component of its own:
+        touched = set([component[r]])
+        touched.update(component[t] for t in neighbors[r] if not is_resp[t])
+        for c in touched:
+            component_rlabels[c].append(rlabel)
+    for i, n in enumerate(nodes):
+        added = component_rlabels.get(component[i])
+        if added:
+            append_rlabels(n, added, plain_names)
+    return set(i for i, c in enumerate(component) if c in touched)
+
+
+def add_rlabels_to_ssm(ssm, fname, graph=None, options=None):
+    """ Find all Responsibility nodes in an SSM dict. For each Responsibility,
+        append an rlabel which uniquely identifies that Responsibility to the
+        "name" value (or, with plain_names, only to the "rlabels" list) of
+        every node connected to that Responsibility.
 
-    Returns:
-            None
+        Args:
+            ssm: an SSM dict; its nodes are changed in place.
+            fname: name of the SSM file, from which rlabels are built (see
+                build_rlabel).
+            graph (optional): the SSMGraph of ssm, if the caller has one.
+            options (optional): the RlabelOptions; by default, get_options().
+
+        Returns:
+            the SSM dict.
     """
-    r_id = r["id"]
-    rlabel = build_rlabel(fname, r_id)
-    init_visitation(nodes, responsibilities)
+    if options is None:
+        options = get_options()
+    if graph is None:
+        graph = SSMGraph(ssm)
+    nodes = graph.nodes
+    if options.plain_names:
+        ssm[RLABELS_IN_NAMES_KEY] = False
+    responsibilities = get_responsibilities(graph)
+    print str(len(responsibilities)) + " responsibility nodes"
+    if len(responsibilities) == 0:
+        return ssm
+    mark_nodes_unvisited(nodes)
     init_rlabel_lists(nodes)
+    rlabels = []
+    for n, r in enumerate(responsibilities):
+        print ("resp #" + str(n) + "; id: " + str(nodes[r]["id"]) +
+               "; name: \"" + ssm_json.printable(nodes[r]["name"]) + "\"")
+        rlabels.append(build_rlabel(fname, nodes[r]["id"], options))
+    if options.undir:
+        visited = rlabel_undirected(graph, responsibilities, rlabels,
+                                    options.plain_names)
+        visited = [i in visited for i in range(len(nodes))]
+    else:
+        visited = rlabel_directed(graph, responsibilities, rlabels,
+                                  options.plain_names)
+    is_resp = graph.shape == RECTANGLE
+    for i, n in enumerate(nodes):
+        n["visited"] = bool(is_resp[i] or visited[i])
+    # print_nodes(graph, 30)
+    return ssm
+
 
-    undirlinks = []
-    for l in links:
-        undirlinks.append({"source": l["source"], "target": l["target"]})
-        undirlinks.append({"source": l["target"], "target": l["source"]})
-
-    q = Queue.Queue()
-    q.put(r)
-    while not q.empty():
-        n = q.get()
-        newname = n["name"] + " " + rlabel
-        n["name"] = newname
-        n["rlabels"].append(rlabel)
-        targets = get_targets_of(n, undirlinks, nodes)
-        for t in targets:
-            if not t["visited"]:
-                t["visited"] = True
-                q.put(t)
-
-
-def add_rlabels_to_single_ssm(inpath, outpath):
-    """ Open the SSM file located at "inpath". Read it into a dict. Find all
-        Responsibility nodes. For each Responsibility, append an rlabel which
-        uniquely identifies that Responsibility to the "name" value of every
-        node connected to that Responsibility.  Write the rlabeled dict as an
-        SSM to outpath.
+def add_rlabels_to_single_ssm(inpath, outpath, options=None):
+    """ Open the SSM file located at "inpath". Read it into a dict, rlabel it
+        (see add_rlabels_to_ssm) and write the rlabeled dict as an SSM to
+        outpath.
 
         Args:
             inpath: full path to an SSM file to be rlabeled.
             outpath: full path to an SSM file that will be the rlabeled
                 equivalent of the SSM at inpath.
+            options (optional): the RlabelOptions; by default, get_options().
 
         Returns:
             None
     """
-    with open(inpath) as json_input_file:
-        json_object = json.load(json_input_file)
-    json_object = convert(json_object)
+    json_object = ssm_json.load(inpath)
     links = json_object["links"]
     nodes = json_object["nodes"]
     print ("inpath: " + inpath + "; " + str(len(links)) + " links; " +
            str(len(nodes)) + " nodes")
-    responsibilities = get_responsibilities(nodes)
-    print str(len(responsibilities)) + " responsibility nodes"
-    for n, r in enumerate(responsibilities):
-        print ("resp #" + str(n) + "; id: " + str(r["id"]) + "; name: \"" +
-               r["name"] + "\"")
-        if undir:
-            traverse_undirected_rgraph(links, nodes, r, responsibilities,
-                                       ntpath.basename(inpath))
-        else:
-            traverse_rgraph(links, nodes, r, responsibilities,
-                            ntpath.basename(inpath))
-    # print_nodes(nodes, 30)
-    with open(outpath, "w") as outfile:
-        json.dump(json_object, outfile)
+    add_rlabels_to_ssm(json_object, ntpath.basename(inpath), options=options)
+    ssm_json.dump(json_object, outpath)
 
 
 def main():
     if len(sys.argv) < 3:
         print ("usage: add_rlabels_to_SSMs.py indir outdir " +
-               "[use_full_filename] [undir]")
+               "[use_full_filename] [undir] [plain_names]")
         return
     indir = sys.argv[1]
     outdir = sys.argv[2]
@@ -383,6 +458,10 @@ def main():
     if len(sys.argv) > 4 and sys.argv[4] in ['t', 'T', "TRUE", "true", "True"]:
         undir = True
 
+    global plain_names
+    if len(sys.argv) > 5 and sys.argv[5] in ['t', 'T', "TRUE", "true", "True"]:
+        plain_names = True
+
     #   print "add_rlabels_to_SSMs.py: inpath = \"" + inpath + "\" " + str(use_full_filename)
 
 #    add_rlabels_to_single_ssm(inpath)
@@ -394,6 +473,7 @@ def main():
 
 use_full_filename = False
 undir = False
+plain_names = False
 
 if __name__ == "__main__":
     main()
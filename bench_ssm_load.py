@@ -0,0 +1,102 @@
+#!/usr/bin/env python
+
+""" bench_ssm_load.py: Compare, file by file, the time and peak memory of
+    loading a directory of System Support Maps (SSMs) the way the processing
+    stages used to (json.load followed by a recursive convert() to utf-8 strs)
+    and with ssm_json.load (see ssm_json.py).
+
+    Usage:
+        bench_ssm_load.py ssm_dir [repeat]
+
+    Args:
+        ssm_dir: A directory of SSM files ending with extension ".json".
+        repeat (optional): the number of times each file is loaded each way;
+            the best time is reported. Default is 5.
+
+    For each file, prints its size, the best load time each way, and the peak
+    resident memory of a child process that loads it once each way (in KB,
+    as reported by getrusage, so it includes the interpreter's own).
+"""
+
+import sys
+import os
+import json
+import time
+import resource
+import ssm_json
+
+DEFAULT_REPEAT = 5
+
+
+def convert(input):
+    """ The recursive conversion the stages used to apply to every document.
+    """
+    if isinstance(input, dict):
+        return {convert(key): convert(value) for key, value in input.iteritems()}
+    elif isinstance(input, list):
+        return [convert(element) for element in input]
+    elif isinstance(input, unicode):
+        return input.encode('utf-8')
+    else:
+        return input
+
+
+def load_and_convert(path):
+    with open(path) as f:
+        return convert(json.load(f))
+
+
+def best_time(load, path, repeat):
+    """ The shortest of "repeat" timings of load(path), in seconds.
+    """
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        load(path)
+        elapsed = time.time() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def peak_memory(load, path):
+    """ The peak resident memory, in KB, of a child process that runs
+        load(path).
+    """
+    pid = os.fork()
+    if pid == 0:
+        load(path)
+        os._exit(0)
+    return os.wait4(pid, 0)[2].ru_maxrss
+
+
+def main():
+    if len(sys.argv) < 2:
+        print "usage: bench_ssm_load.py ssm_dir [repeat]"
+        return
+    ssm_dir = sys.argv[1]
+    repeat = int(sys.argv[2]) if len(sys.argv) > 2 else DEFAULT_REPEAT
+    files = sorted(fn for fn in os.listdir(ssm_dir)
+                   if fn.endswith(".json") and not fn.startswith("."))
+    print "%-40s %10s %10s %10s %6s %10s %10s" % (
+        "file", "bytes", "convert s", "ssm_json s", "x", "convert KB",
+        "ssm_json KB")
+    totals = [0.0, 0.0]
+    for fn in files:
+        path = os.path.join(ssm_dir, fn)
+        old = best_time(load_and_convert, path, repeat)
+        new = best_time(ssm_json.load, path, repeat)
+        totals[0] += old
+        totals[1] += new
+        print "%-40s %10d %10.4f %10.4f %6.2f %10d %10d" % (
+            fn[-40:], os.path.getsize(path), old, new, old / max(new, 1e-9),
+            peak_memory(load_and_convert, path),
+            peak_memory(ssm_json.load, path))
+    if files:
+        print "%-40s %10s %10.4f %10.4f %6.2f" % (
+            "total", "", totals[0], totals[1],
+            totals[0] / max(totals[1], 1e-9))
+
+
+if __name__ == "__main__":
+    main()
@@ -17,6 +17,7 @@ import sys
 import os
 import collections
 import json
+import ssm_json
 import string
 import psycopg2
 
@@ -45,9 +46,8 @@ def cat_files(path_list):
     out["sorted"] = []
     for path in path_list:
         #print(path)
-        with open(path) as json_data:
-            d = json.load(json_data)
-            curr_sorted = d["sorted"]
+        d = ssm_json.load(path)
+        curr_sorted = d["sorted"]
         #print(curr_sorted)
         out["sorted"].extend(curr_sorted)
     return out
@@ -61,8 +61,7 @@ def main():
     jsonOut = cat_files(path_list)
     #print(json.dumps(jsonOut))
     outfilepath = dir + "/cattedJSON.json"
-    with open(outfilepath, 'w') as outfile:
-        json.dump(jsonOut, outfile)
+    ssm_json.dump(jsonOut, outfilepath)
     print "done."
 
 
@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+
+""" extract_maps.py: Retrieve and write as .json files, in a single pass over
+    the "maps" table of the ssm database, the system support maps (ssms) for
+    several different extractions at once. Does in one database round trip
+    what would otherwise take one run each of get_maps_by_version.py,
+    get_NY_maps_with_demo.py, get_mental_maps.py, etc.
+
+    Usage:
+        extract_maps.py spec_file
+
+    Arg:
+        spec_file: path to a JSON file that contains a list of named filter
+        specs. Each spec is a dict with these keys:
+
+            name: a label for the extraction, used in tracking output.
+            dir: the directory into which matching ssm .json files are to be
+                written. If it doesn't exist it will be created.
+            layout: how output files are named, following one of the single-
+                purpose extractors:
+                    "version": <version>-<role>-<id>.json
+                        (as get_maps_by_version.py; the spec needs a
+                        "version" criterion)
+                    "role":    <role>-<id>.json
+                        (as get_NY_maps_with_demo.py)
+                    "school":  ssm-<schoolLocation>-<id>.json
+                        (as get_mental_maps.py; the spec needs "has_key":
+                        "schoolLocation")
+            version, state, has_key, exclude_owners, modified_since
+                (all optional): selection criteria, as described in
+                ssm_utilities.build_maps_predicate.
+
+        For example:
+
+        [
+            {"name": "v3", "dir": "out/v3", "layout": "version",
+             "version": "3"},
+            {"name": "NY", "dir": "out/NY", "layout": "role",
+             "state": "NY", "exclude_owners": [2]},
+            {"name": "mental", "dir": "out/mental", "layout": "school",
+             "has_key": "schoolLocation", "exclude_owners": [2, 20]}
+        ]
+
+    The specs are combined into a single query (a map is fetched if it
+    matches any spec) whose rows are streamed in ascending order of last
+    modified timestamp. Each row is then routed to the output directory of
+    every spec it matches, so a map can be written to more than one place.
+    Which specs a map matches, and the roles and labels its files are named
+    by, are computed by the database in the same query (see
+    ssm_utilities.build_routing_query), so routing always agrees with the
+    selection, and files are named as the single-purpose extractors name
+    them.
+
+    From PostgreSQL database:
+    -> extract list of tuples that match at least one spec
+    -> for each tuple, write its dict to file for each spec it matches
+"""
+
+import sys
+import os
+import json
+from ssm_utilities import MAPS_COLUMNS, iter_routed_maps
+from ssm_writer import MapWriter
+import get_maps_by_version
+import get_NY_maps_with_demo
+import get_mental_maps
+
+# Spec keys that are selection criteria (see build_maps_predicate):
+CRITERIA_KEYS = ("version", "state", "has_key", "exclude_owners",
+                 "modified_since")
+
+# The roles computed by the database (see build_routing_query): the "role"
+# of get_maps_by_version.py, and that of get_NY_maps_with_demo.py:
+ROLES = (("shape", "circle"), ("type", "role"))
+
+# The labels computed by the database, as the "label" column of
+# get_maps_by_version.py and that of get_mental_maps.py:
+LABELS = ("version", "schoolLocation")
+
+# The criterion each layout needs, as a (key, value) pair (a value of None
+# means any), so that every map it writes has the label it is named by:
+LAYOUT_CRITERIA = {
+    "version": ("version", None),
+    "school": ("has_key", "schoolLocation")
+}
+
+IX_SSM_ID = MAPS_COLUMNS.index("id")
+IX_DOC = MAPS_COLUMNS.index("document")
+IX_MODIFIED_AT = MAPS_COLUMNS.index("modified_at")
+IX_VERSION_ROLE = len(MAPS_COLUMNS)
+IX_ROLE = IX_VERSION_ROLE + 1
+IX_VERSION = len(MAPS_COLUMNS) + len(ROLES)
+IX_SCHOOL_LOCATION = IX_VERSION + 1
+IX_MATCHES = len(MAPS_COLUMNS) + len(ROLES) + len(LABELS)
+
+
+def write_version_layout(writer, dir, map):
+    vrsn = str(map[IX_VERSION])
+    get_maps_by_version.write_map_to_file(writer, dir, vrsn,
+                                          map[IX_VERSION_ROLE],
+                                          map[IX_SSM_ID], map[IX_DOC])
+
+
+def write_role_layout(writer, dir, map):
+    get_NY_maps_with_demo.write_map_to_file(writer, dir, map[IX_ROLE],
+                                            map[IX_SSM_ID], map[IX_DOC])
+
+
+def write_school_layout(writer, dir, map):
+    loc = str(map[IX_SCHOOL_LOCATION])
+    get_mental_maps.write_map_to_file(writer, dir, loc, map[IX_SSM_ID],
+                                      map[IX_DOC])
+
+
+LAYOUTS = {
+    "version": write_version_layout,
+    "role": write_role_layout,
+    "school": write_school_layout
+}
+
+
+def read_specs(path):
+    """ Read and check a file of filter specs (see module docstring).
+
+        Arg:
+            path: path to a JSON spec file.
+
+        Returns:
+            a list of spec dicts, or None if the file has an invalid spec (in
+            which case the problem is printed to stdout).
+    """
+    with open(path) as f:
+        specs = json.load(f)
+    for i, spec in enumerate(specs):
+        for key in ("name", "dir", "layout"):
+            if key not in spec:
+                print "spec #" + str(i) + " has no \"" + key + "\""
+                return None
+        if spec["layout"] not in LAYOUTS:
+            print ("spec \"" + spec["name"] + "\": unknown layout \"" +
+                   spec["layout"] + "\"")
+            return None
+        if spec["layout"] in LAYOUT_CRITERIA:
+            key, value = LAYOUT_CRITERIA[spec["layout"]]
+            if spec.get(key) is None or value not in (None, spec[key]):
+                print ("spec \"" + spec["name"] + "\": layout \"" +
+                       spec["layout"] + "\" needs \"" + key + "\"" +
+                       ("" if value is None else ": \"" + value + "\""))
+                return None
+        for key in spec:
+            if key not in CRITERIA_KEYS and key not in ("name", "dir",
+                                                        "layout"):
+                print ("spec \"" + spec["name"] + "\": unknown key \"" + key +
+                       "\"")
+                return None
+    return specs
+
+
+def get_criteria(spec):
+    """ The selection criteria in a spec, as keyword arguments for
+        build_maps_predicate.
+    """
+    return dict((str(k), v) for k, v in spec.iteritems() if k in CRITERIA_KEYS)
+
+
+def print_row(n, map_id, names, last_modified):
+    print ("%s. id %s  %s  -> %s" % (str(n).rjust(4), str(map_id).rjust(6),
+                                     last_modified, ", ".join(names)))
+
+
+def main():
+    if len(sys.argv) < 2:
+        print "usage: extract_maps.py spec_file"
+        return
+    specs = read_specs(sys.argv[1])
+    if specs is None:
+        return
+    criteria = [get_criteria(spec) for spec in specs]
+    counts = [0] * len(specs)
+    with MapWriter() as writer:
+        n = 0
+        for map in iter_routed_maps(criteria, ROLES, LABELS):
+            map_id = map[IX_SSM_ID]
+            last_modified = map[IX_MODIFIED_AT].strftime("%Y-%m-%d %H:%M")
+            names = []
+            for i, spec in enumerate(specs):
+                if map[IX_MATCHES + i]:
+                    LAYOUTS[spec["layout"]](writer, spec["dir"], map)
+                    names.append(spec["name"])
+                    counts[i] += 1
+            n += 1
+            print_row(n, map_id, names, last_modified)
+    print "\n" + str(n) + " maps fetched"
+    for i, spec in enumerate(specs):
+        print (spec["name"] + ": " + str(counts[i]) + " written to " +
+               spec["dir"])
+
+
+if __name__ == "__main__":
+    main()
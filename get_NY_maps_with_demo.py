@@ -5,50 +5,52 @@
     the "document" field and where the associated value is "NY".
 
     Usage:
-        get_NY_maps_with_demo.py output_directory
+        get_NY_maps_with_demo.py output_directory [dry_run]
 
     Args:
         output_directory: a directory into which all the ssm .json files are to
         be written. If it doesn't exist it will be created.
+        dry_run (optional): Boolean. If true, list the matching maps without
+        fetching or writing the documents themselves. Default is False.
 
-    The "SELECT * from maps" statement returns a list of tuples. Each tuple is
-    an ssm plus its associated metadata and is comprised of the following
-    elements:
+    The maps query (see ssm_utilities.iter_map_summaries) streams a sequence
+    of tuples, filtered in the database on the document "state" value and the
+    owner id. Each tuple is an ssm plus metadata, some of it computed in the
+    database, and is comprised of the following elements:
 
-    index type      contents                 column name in database
+    index type      contents                     column name or expression
     ___________________________________________________________________________
-    0     int       map id                   id
-    1     int       owner id                 owner
-    2     dict      the ssm                  document
-    3     datetime  created timestamp        created_at
-    4     datetime  last modified timestamp  modified_at
-    5     str       map name                 name
-
-    The tuples in the list are sorted in ascending order of the elements with
-    index 4 (last modified timestamp).
-
-    The element at index 3 in each tuple in the list is a dict which contains
-    the actual system support map. For our present purposes we're interested
-    only in those dicts which contain a "state" key and a corresponding value
-    = "NY".
+    0     int       map id                       id
+    1     int       owner id                     owner
+    2     datetime  last modified timestamp      modified_at
+    3     unicode   map name                     name
+    4     int       size of the ssm in bytes     octet_length(document::text)
+    5     unicode   name of first "role" node    (from document->'nodes')
+    6     unicode   (unused)                     NULL
+    7     dict      the ssm (None in a dry run)  document
+
+    The tuples are sorted by the database in ascending order of the elements
+    with index 2 (last modified timestamp).
+
+    The element at index 7 in each tuple is a dict which contains the actual
+    system support map. For our present purposes we're interested only in those
+    dicts which contain a "state" key and a corresponding value = "NY".
 
     For each one of those ssms that meets this criterion, print some useful
     tracking info to stdout and write the dict to file in .json format.
 
     From PostgreSQL database:
-    -> extract list of tuples
-    -> examine each tuple of metadata + dict
-    -> write to file each dict with key "state" the value of which = "NY"
+    -> extract list of tuples with key "state" the value of which = "NY"
+    -> write each dict to file
 """
 
 import sys
 import os
 import collections
-import json
 import string
 import re
-import psycopg2
-from ssm_utilities import connect, get_maps
+from ssm_utilities import iter_map_summaries
+from ssm_writer import MapWriter
 
 
 def print_header():
@@ -118,10 +120,11 @@ def build_output_file_path(dir, role, id):
     return re.sub(r'(_)\1+', r'\1', path)
 
 
-def write_map_to_file(dir, role, map_id, d):
+def write_map_to_file(writer, dir, role, map_id, d):
     """ Write a dict to an ssm .json file.
 
         Args:
+            writer: the ssm_writer.MapWriter that writes the file.
             dir: string path to directory.
             role: the value of the "role" node in the map
             map_id: int used to build file name.
@@ -130,54 +133,42 @@ def write_map_to_file(dir, role, map_id, d):
         Returns:
             Nothing
     """
-    if not os.path.exists(dir):
-        os.makedirs(dir)
     path = build_output_file_path(dir, role, map_id)
-    with open(path, "w") as f:
-        json.dump(d, f, sort_keys=True, indent=4)
-        f.close()
-
-
-def get_role(ssm):
-    """ Get the role the user entered in ssm.
-
-        Arg:
-            ssm: A System Support Map.
-
-        Returns:
-            the "name" value of the node with type "role," unless there is no
-            such node, in which case "no role" is returned.
-    """
-    nodes = ssm["nodes"]
-    for node in nodes:
-        if node["type"] == "role":
-            return node["name"]
-    return "no role"
+    writer.write(path, d, map_id)
 
 
 def main():
     IX_SSM_ID = 0
     IX_OWNER_ID = 1
-    IX_DOC = 2
-    IX_MODIFIED_AT = 4
-    IX_SSM_NAME = 5
+    IX_MODIFIED_AT = 2
+    IX_SSM_NAME = 3
+    IX_SIZE = 4
+    IX_ROLE = 5
+    IX_LABEL = 6
+    IX_DOC = 7
+    if len(sys.argv) < 2:
+        print "usage: get_NY_maps_with_demo.py output_directory [dry_run]"
+        return
     dir = sys.argv[1]
-    maps = get_maps(IX_MODIFIED_AT)
-    n = 0
-    print_header()
-    for map in maps:
-        map_id = map[IX_SSM_ID]
-        owner = map[IX_OWNER_ID]
-        last_modified = map[IX_MODIFIED_AT].strftime("%Y-%m-%d %H:%M")
-        name = map[IX_SSM_NAME]
-        d = map[IX_DOC]
-        if "state" in d and str(d["state"]) == "NY" and owner not in [2]: #noSC
-            # and owner not in [2, 20]: # exclude SC, KHL
+    dry_run = (len(sys.argv) > 2 and
+               sys.argv[2] in ['t', 'T', "TRUE", "true", "True"])
+    maps = iter_map_summaries(role_key="type", role_value="role",
+                              with_document=not dry_run,
+                              state="NY", exclude_owners=[2]) # exclude SC
+    with MapWriter() as writer:
+        n = 0
+        print_header()
+        for map in maps:
+            map_id = map[IX_SSM_ID]
+            owner = map[IX_OWNER_ID]
+            last_modified = map[IX_MODIFIED_AT].strftime("%Y-%m-%d %H:%M")
+            name = map[IX_SSM_NAME]
             n += 1
-            sz = str(len(str(d)))
-            role = get_role(d)
+            sz = str(map[IX_SIZE])
+            role = map[IX_ROLE]
             print_row(n, sz, last_modified)
-            write_map_to_file(dir, role, map_id, d)
+            if not dry_run:
+                write_map_to_file(writer, dir, role, map_id, map[IX_DOC])
 
 
 if __name__ == "__main__":
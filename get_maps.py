@@ -4,92 +4,70 @@
     support maps (ssms) from the ssm database.
 
     Usage:
-        get_maps.py start_date output_directory
+        get_maps.py start_date output_directory [incremental]
 
     Args:
         start_date: a string that identifies the earlist maps to be retrieved.
         output_directory: a directory into which all the ssm .json files are to
         be written. If it doesn't exist it will be created.
-
-    The "SELECT * from maps" statement returns a list of tuples. Each tuple is
-    an ssm plus its associated metadata and is comprised of the following
-    elements:
-
-    index type      contents                 column name in database
+        incremental (optional): Boolean. If true, retrieve only those maps that
+        have changed since the previous incremental run into
+        output_directory, as recorded in its checkpoint file (see
+        ssm_utilities.CHECKPOINT_FILE). Files for unchanged maps are left
+        untouched. Default is False (retrieve everything since start_date).
+
+    The maps query (see ssm_utilities.iter_map_summaries) streams a sequence
+    of tuples, filtered in the database on the last modified timestamp. Each
+    tuple is an ssm plus metadata, some of it computed in the database, and is
+    comprised of the following elements:
+
+    index type      contents                     column name or expression
     ___________________________________________________________________________
-    0     int       map id                   id
-    1     int       owner id                 owner
-    2     dict      the ssm                  document
-    3     datetime  created timestamp        created_at
-    4     datetime  last modified timestamp  modified_at
-    5     str       map name                 name
-
-    The tuples in the list are sorted in ascending order of the elements with
-    index 4 (last modified timestamp).
-
-    The element at index r in each tuple in the list is a dict which contains
-    the actual system support map. For our present purposes we're interested
-    only in those dicts which contain a "modified_at" value greater than or
-    equal to the "start_date" command line argument.
+    0     int       map id                       id
+    1     int       owner id                     owner
+    2     datetime  last modified timestamp      modified_at
+    3     unicode   map name                     name
+    4     int       size of the ssm in bytes     octet_length(document::text)
+    5     unicode   name of first "role" node    (from document->'nodes')
+    6     unicode   "version" value              document->>'version'
+    7     dict      the ssm (None in a dry run)  document
+
+    The tuples are sorted by the database in ascending order of the elements
+    with index 2 (last modified timestamp), ties broken by map id.
+
+    The element at index 7 in each tuple is a dict which contains the actual
+    system support map. For our present purposes we're interested only in those
+    maps with a "modified_at" value greater than or equal to the "start_date"
+    command line argument and, in incremental mode, to the watermark of the
+    last map written by the previous incremental run, less a lookback window
+    (see ssm_utilities.get_incremental_start): a map whose transaction
+    committed after that run can carry an earlier timestamp than the maps it
+    read. Maps read again are skipped if their content is unchanged.
 
     For each one of those ssms that meets this criterion, print some useful
-    tracking info to stdout and write the dict to file in .json format.
+    tracking info to stdout and write the dict to file in .json format, unless
+    the file already holds exactly that content (see ssm_writer.MapWriter and
+    its manifest). In incremental mode, once every map has been written,
+    advance the watermark.
 
     From PostgreSQL database:
-    -> extract list of tuples
-    -> examine each tuple of metadata + dict
-    -> write to file each dict with modified_at >= start_date
+    -> extract list of tuples with modified_at >= start_date (and >= the
+       watermark less the lookback window, if incremental)
+    -> write each dict to file
+    -> record the watermark (if incremental)
 """
 
 import sys
 import os
 import collections
-import json
 import string
 import re
-import psycopg2
-
-
-def connect():
-    """ Connect to ssm PostgreSQL database
-
-        Args:
-            None: hardwired to a particular database.
-
-        Returns:
-            connection to database.
-     """
-    conn = None
-    try:
-        print "Connecting to ssm database..."
-        conn = psycopg2.connect(host="",
-                                database="",
-                                user="",
-                                port="")
-    except (Exception, psycopg2.DatabaseError) as error:
-        print error
-    return conn
-
-
-def get_maps(sort_index):
-    """ Get a list of tuples from the PostgreSQL database, each tuple of which
-        is a dict representing an ssm plus associated metadata.
-
-        Arg:
-            sort_index: the int index of the tuple elements to be used as the
-            basis for sorting the tuples in the list.
+from ssm_utilities import iter_map_summaries, parse_timestamp, \
+    get_incremental_start, write_checkpoint
+from ssm_writer import MapWriter
 
-        Returns:
-            a sorted list of tuples.
-    """
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT * from maps")
-    maps = cur.fetchall()
-    cur.close()
-    conn.close()
-    print "number of maps fetched: " + str(len(maps))
-    return sorted(maps, key=lambda k: k[sort_index])
+# The map id at the end of an ssm file name (see build_output_file_path):
+MAP_FILE_ID = re.compile(r"-(\d+)\.json$")
 
 
 def print_header():
@@ -136,12 +114,13 @@ def print_row(n, version, sz, last_modified):
     print (get_pad1(n) + str(n) + ". " + sz + " " * 13 + last_modified)
 
 
-def build_output_file_path(dir, role, id):
+def build_output_file_path(dir, version, role, id):
     """ Create a full path for an ssm file.
 
         Args:
             dir: string path to directory, either relative or absolute. No
             checking to see if the path is valid.
+            version: string version to be used in assembling the file name.
             role: the value of the "role" node in the map
             id: integer to be used in assembling the file name.
 
@@ -153,16 +132,20 @@ def build_output_file_path(dir, role, id):
     punct = string.punctuation
     junk = punct + " "
     trantab = string.maketrans(junk, "_________________________________")
+    clean_version = version.strip(junk).translate(trantab)
     clean_role = role.encode("ascii", "replace").strip(junk).translate(trantab)
     path = (clean_dir + "/" + clean_version + "-" + clean_role + "-" +
             str(id) + ".json")
     return re.sub(r'(_)\1+', r'\1', path)
 
 
-def write_map_to_file(dir, version, role, map_id, d):
+def write_map_to_file(writer, files, dir, version, role, map_id, d):
     """ Write a dict to an ssm .json file.
 
         Args:
+            writer: the ssm_writer.MapWriter that writes the file.
+            files: the index of the files already in dir, from
+                build_map_file_index.
             dir: string path to directory.
             version: string used to build file name.
             role: the value of the "role" node in the map
@@ -172,56 +155,99 @@ def write_map_to_file(dir, version, role, map_id, d):
         Returns:
             Nothing
     """
-    if not os.path.exists(dir):
-        os.makedirs(dir)
     path = build_output_file_path(dir, version, role, map_id)
-    with open(path, "w") as f:
-        json.dump(d, f, sort_keys=True, indent=4)
-        f.close()
+    remove_stale_files(files, dir, map_id, path)
+    writer.write(path, d, map_id)
 
 
-def get_role(ssm):
-    """ Get the role the user entered in ssm.
+def build_map_file_index(dir):
+    """ Index the ssm files already in an output directory by map id, so that
+        each map's earlier files can be found without listing the directory
+        again.
 
         Arg:
-            ssm: A System Support Map.
+            dir: string path to directory.
+
+        Returns:
+            a dict from int map id to the list of names of the files in dir
+            that end in "-<map id>.json" (empty if dir doesn't exist).
+    """
+    files = collections.defaultdict(list)
+    if not os.path.isdir(dir):
+        return files
+    for fn in os.listdir(dir):
+        match = MAP_FILE_ID.search(fn)
+        if match:
+            files[int(match.group(1))].append(fn)
+    return files
+
+
+def remove_stale_files(files, dir, map_id, path):
+    """ Delete any earlier file for the map with id map_id that was written
+        under a different name (e.g., because its role has since been edited),
+        so that an incremental run never leaves two copies of one map.
+
+        Args:
+            files: the index of the files in dir, from build_map_file_index.
+                Updated to hold only the file at path for map_id.
+            dir: string path to directory.
+            map_id: int id of the map about to be written.
+            path: the full path the map is about to be written to.
 
         Returns:
-            the "name" value of the node with type "role," unless there is no
-            such node, in which case "no role" is returned.
+            Nothing
     """
-    nodes = ssm["nodes"]
-    for node in nodes:
-        if node["type"] == "role":
-            return node["name"]
-    return "no role"
+    for fn in files.pop(map_id, []):
+        stale = dir.rstrip("/") + "/" + fn
+        if stale != path:
+            os.remove(stale)
+    files[map_id] = [os.path.basename(path)]
 
 
 def main():
     IX_SSM_ID = 0
     IX_OWNER_ID = 1
-    IX_DOC = 2
-    IX_MODIFIED_AT = 4
-    IX_SSM_NAME = 5
-    version = sys.argv[1]
+    IX_MODIFIED_AT = 2
+    IX_SSM_NAME = 3
+    IX_SIZE = 4
+    IX_ROLE = 5
+    IX_LABEL = 6
+    IX_DOC = 7
+    if len(sys.argv) < 3:
+        print "usage: get_maps.py start_date output_directory [incremental]"
+        return
+    start_date = sys.argv[1]
     dir = sys.argv[2]
-    maps = get_maps(IX_MODIFIED_AT)
-    n = 0
-    print_header()
-    for map in maps:
-        map_id = map[IX_SSM_ID]
-        owner = map[IX_OWNER_ID]
-        last_modified = map[IX_MODIFIED_AT].strftime("%Y-%m-%d %H:%M")
-        name = map[IX_SSM_NAME]
-        d = map[IX_DOC]
-        if "version" in d and str(d["version"]) == version:
-            # and owner not in [2, 20]: # exclude SC, KHL
+    incremental = (len(sys.argv) > 3 and
+                   sys.argv[3] in ['t', 'T', "TRUE", "true", "True"])
+    since = start_date
+    incremental_start = get_incremental_start(dir) if incremental else None
+    if (incremental_start is not None and
+            incremental_start > parse_timestamp(start_date)):
+        since = incremental_start
+        print "Retrieving maps changed since " + since.isoformat()
+    maps = iter_map_summaries(role_key="type", role_value="role",
+                              label_key="version", modified_since=since)
+    with MapWriter(full_run=not incremental) as writer:
+        files = build_map_file_index(dir)
+        n = 0
+        last = None
+        print_header()
+        for map in maps:
+            map_id = map[IX_SSM_ID]
+            owner = map[IX_OWNER_ID]
+            last_modified = map[IX_MODIFIED_AT].strftime("%Y-%m-%d %H:%M")
+            name = map[IX_SSM_NAME]
             n += 1
-            sz = str(len(str(d)))
-            role = get_role(d)
-            vrsn = str(d["version"])
+            sz = str(map[IX_SIZE])
+            role = map[IX_ROLE]
+            vrsn = str(map[IX_LABEL] or "no version")
             print_row(n, vrsn, sz, last_modified)
-            write_map_to_file(dir, vrsn, role, map_id, d)
+            write_map_to_file(writer, files, dir, vrsn, role, map_id,
+                              map[IX_DOC])
+            last = map
+    if incremental and last is not None:
+        write_checkpoint(dir, last[IX_MODIFIED_AT], last[IX_SSM_ID])
 
 
 if __name__ == "__main__":
@@ -5,94 +5,56 @@
     the "document" field that matches command line argument "version."
 
     Usage:
-        get_maps_by_version.py version output_directory
+        get_maps_by_version.py version output_directory [dry_run]
 
     Args:
         version: a string that identifies the "version" of one of the ssm
         family of websites.
         output_directory: a directory into which all the ssm .json files are to
         be written. If it doesn't exist it will be created.
+        dry_run (optional): Boolean. If true, list the matching maps without
+        fetching or writing the documents themselves. Default is False.
 
-    The "SELECT * from maps" statement returns a list of tuples. Each tuple is
-    an ssm plus its associated metadata and is comprised of the following
-    elements:
+    The maps query (see ssm_utilities.iter_map_summaries) streams a sequence
+    of tuples, filtered in the database on the document "version" value. Each
+    tuple is an ssm plus metadata, some of it computed in the database, and is
+    comprised of the following elements:
 
-    index type      contents                 column name in database
+    index type      contents                     column name or expression
     ___________________________________________________________________________
-    0     int       map id                   id
-    1     int       owner id                 owner
-    2     dict      the ssm                  document
-    3     datetime  created timestamp        created_at
-    4     datetime  last modified timestamp  modified_at
-    5     str       map name                 name
-
-    The tuples in the list are sorted in ascending order of the elements with
-    index 4 (last modified timestamp).
-
-    The element at index 3 in each tuple in the list is a dict which contains
-    the actual system support map. For our present purposes we're interested
-    only in those dicts which contain a "version" key and a corresponding value
-    that matches the "version" command line argument.
+    0     int       map id                       id
+    1     int       owner id                     owner
+    2     datetime  last modified timestamp      modified_at
+    3     unicode   map name                     name
+    4     int       size of the ssm in bytes     octet_length(document::text)
+    5     unicode   name of first "circle" node  (from document->'nodes')
+    6     unicode   "version" value              document->>'version'
+    7     dict      the ssm (None in a dry run)  document
+
+    The tuples are sorted by the database in ascending order of the elements
+    with index 2 (last modified timestamp).
+
+    The element at index 7 in each tuple is a dict which contains the actual
+    system support map. For our present purposes we're interested only in those
+    dicts which contain a "version" key and a corresponding value that matches
+    the "version" command line argument.
 
     For each one of those ssms that meets this criterion, print some useful
     tracking info to stdout and write the dict to file in .json format.
 
     From PostgreSQL database:
-    -> extract list of tuples
-    -> examine each tuple of metadata + dict
-    -> write to file each dict with key "version" the value of which matches
+    -> extract list of tuples with key "version" the value of which matches
        command line argument "version"
+    -> write each dict to file
 """
 
 import sys
 import os
 import collections
-import json
 import string
 import re
-import psycopg2
-
-
-def connect():
-    """ Connect to ssm PostgreSQL database
-
-        Args:
-            None: hardwired to a particular database.
-
-        Returns:
-            connection to database.
-     """
-    conn = None
-    try:
-        #print "Connecting to ssm database..."
-        conn = psycopg2.connect(host="",
-                                database="",
-                                user="",
-                                port="")
-    except (Exception, psycopg2.DatabaseError) as error:
-        print error
-    return conn
-
-
-def get_maps(sort_index):
-    """ Get a list of tuples from the PostgreSQL database, each tuple of which
-        is a dict representing an ssm plus associated metadata.
-
-        Arg:
-            sort_index: the int index of the tuple elements to be used as the
-            basis for sorting the tuples in the list.
-
-        Returns:
-            a sorted list of tuples.
-    """
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT * from maps")
-    maps = cur.fetchall()
-    cur.close()
-    conn.close()
-    #print "number of maps fetched: " + str(len(maps))
-    return sorted(maps, key=lambda k: k[sort_index])
+from ssm_utilities import iter_map_summaries
+from ssm_writer import MapWriter
 
 
 def print_header():
@@ -167,10 +129,11 @@ def build_output_file_path(dir, version, role, id):
     return re.sub(r'(_)\1+', r'\1', path)
 
 
-def write_map_to_file(dir, version, role, map_id, d):
+def write_map_to_file(writer, dir, version, role, map_id, d):
     """ Write a dict to an ssm .json file.
 
         Args:
+            writer: the ssm_writer.MapWriter that writes the file.
             dir: string path to directory.
             version: string used to build file name.
             role: the value of the "role" node in the map
@@ -180,59 +143,45 @@ def write_map_to_file(dir, version, role, map_id, d):
         Returns:
             Nothing
     """
-    if not os.path.exists(dir):
-        os.makedirs(dir)
     path = build_output_file_path(dir, version, role, map_id)
-    with open(path, "w") as f:
-        json.dump(d, f, sort_keys=True, indent=4)
-        f.close()
-
-
-def get_role(ssm):
-    """ Get the role the user entered in ssm.
-
-        Arg:
-            ssm: A System Support Map.
-
-        Returns:
-            the "name" value of the node with type "role," unless there is no
-            such node, in which case "no role" is returned.
-    """
-    nodes = ssm["nodes"]
-    for node in nodes:
-        #if node["type"] == "role":
-        if node["shape"] == "circle":
-            return node["name"]
-    return "no role"
+    writer.write(path, d, map_id)
 
 
 def main():
     IX_SSM_ID = 0
     IX_OWNER_ID = 1
-    IX_DOC = 2
-    IX_MODIFIED_AT = 4
-    IX_SSM_NAME = 5
+    IX_MODIFIED_AT = 2
+    IX_SSM_NAME = 3
+    IX_SIZE = 4
+    IX_ROLE = 5
+    IX_LABEL = 6
+    IX_DOC = 7
+    if len(sys.argv) < 3:
+        print ("usage: get_maps_by_version.py version output_directory " +
+               "[dry_run]")
+        return
     version = sys.argv[1]
     dir = sys.argv[2]
-    maps = get_maps(IX_MODIFIED_AT)
-    n = 0
-    print_header()
-    for map in maps:
-        map_id = map[IX_SSM_ID]
-        owner = map[IX_OWNER_ID]
-        last_modified = map[IX_MODIFIED_AT].strftime("%Y-%m-%d %H:%M")
-        name = map[IX_SSM_NAME]
-        d = map[IX_DOC]
-	if "version" in d:
-	    print str(d["version"])
-        if "version" in d and str(d["version"]) == version:
-            # and owner not in [2, 20]: # exclude SC, KHL
+    dry_run = (len(sys.argv) > 3 and
+               sys.argv[3] in ['t', 'T', "TRUE", "true", "True"])
+    maps = iter_map_summaries(role_key="shape", role_value="circle",
+                              label_key="version", with_document=not dry_run,
+                              version=version)
+    with MapWriter() as writer:
+        n = 0
+        print_header()
+        for map in maps:
+            map_id = map[IX_SSM_ID]
+            owner = map[IX_OWNER_ID]
+            last_modified = map[IX_MODIFIED_AT].strftime("%Y-%m-%d %H:%M")
+            name = map[IX_SSM_NAME]
             n += 1
-            sz = str(len(str(d)))
-            role = get_role(d)
-            vrsn = str(d["version"])
+            sz = str(map[IX_SIZE])
+            role = map[IX_ROLE]
+            vrsn = str(map[IX_LABEL])
             print_row(n, vrsn, sz, last_modified)
-            write_map_to_file(dir, vrsn, role, map_id, d)
+            if not dry_run:
+                write_map_to_file(writer, dir, vrsn, role, map_id, map[IX_DOC])
 
 
 if __name__ == "__main__":
@@ -7,89 +7,53 @@
     https://github.com/steve9000gi/ssm/tree/wizard-mental-health-in-schools.
 
     Usage:
-        get_mental_maps.py output_directory
+        get_mental_maps.py output_directory [dry_run]
 
     Arg:
         output_directory: a directory into which all the ssm .json files are to
         be written. If it doesn't exist it will be created.
+        dry_run (optional): Boolean. If true, list the matching maps without
+        fetching or writing the documents themselves. Default is False.
 
-    The "SELECT * from maps" statement returns a list of tuples. Each tuple is
-    an ssm plus its associated metadata and is comprised of the following
-    elements:
+    The maps query (see ssm_utilities.iter_map_summaries) streams a sequence
+    of tuples, filtered in the database on the presence of a "schoolLocation"
+    key and the owner id. Each tuple is an ssm plus metadata, some of it
+    computed in the database, and is comprised of the following elements:
 
-    index type      contents                 column name in database
+    index type      contents                     column name or expression
     ___________________________________________________________________________
-    0     int       map id                   id
-    1     int       owner id                 owner
-    2     dict      the ssm                  document
-    3     datetime  created timestamp        created_at
-    4     datetime  last modified timestamp  modified_at
-    5     str       map name                 name
-
-    The tuples in the list are sorted in ascending order of the elements with
-    index 4 (last modified timestamp).
-
-    The element at index 3 in each tuple in the list is a dict which contains
-    the actual system support map. For the purposes of this study we're
-    interested only in those dicts which contain a "schoolLocation" key
-    because only those database elements are generated by the website custom-
-    modified for the "Roles in Mental Health Care within Schools in Connecticut"
-    research study.
+    0     int       map id                       id
+    1     int       owner id                     owner
+    2     datetime  last modified timestamp      modified_at
+    3     unicode   map name                     name
+    4     int       size of the ssm in bytes     octet_length(document::text)
+    5     unicode   (unused)                     NULL
+    6     unicode   "schoolLocation" value       document->>'schoolLocation'
+    7     dict      the ssm (None in a dry run)  document
+
+    The tuples are sorted by the database in ascending order of the elements
+    with index 2 (last modified timestamp).
+
+    The element at index 7 in each tuple is a dict which contains the actual
+    system support map. For the purposes of this study we're interested only in
+    those dicts which contain a "schoolLocation" key because only those
+    database elements are generated by the website custom-modified for the
+    "Roles in Mental Health Care within Schools in Connecticut" research study.
 
     For each one of those ssms that meets this criterion, print some useful
     tracking info to stdout and write the dict to file in .json format.
 
     from PostGres database
-    -> extract list of tuples
-    -> examine each tuple of metadata + dict
-    -> write dict with key "schoolLocation" to file
+    -> extract list of tuples with key "schoolLocation"
+    -> write each dict to file
 """
 
 import sys
 import os
 import collections
-import json
 import string
-import psycopg2
-
-def connect():
-    """ Connect to ssm PostgreSQL database
-
-        Args:
-            None: hardwired to a particular database.
-
-        Returns:
-            connection to database.
-     """
-    conn = None
-    try:
-        print "Connecting to ssm database..."
-        conn = psycopg2.connect(host="",
-                                database="",
-                                user="")
-    except (Exception, psycopg2.DatabaseError) as error:
-        print error
-    return conn
-
-def get_maps(sort_index):
-    """ Get a list of tuples from the PostgreSQL database, each tuple of which
-        is a dict representing an ssm plus associated metadata.
-
-        Arg:
-            sort_index: the int index of the tuple elements to be used as the
-            basis for sorting the tuples in the list.
-
-        Returns:
-            a sorted list of tuples.
-    """
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT * from maps")
-    maps = cur.fetchall()
-    cur.close()
-    conn.close()
-    print "number of maps fetched: " + str(len(maps))
-    return sorted(maps, key=lambda k: k[sort_index])
+from ssm_utilities import iter_map_summaries
+from ssm_writer import MapWriter
 
 def print_header():
     print ("      Location of school                  Size (bytes)     " +
@@ -152,10 +116,11 @@ def build_output_file_path(dir, loc, id):
     clean_loc = clean_loc.replace(" ", "_")
     return clean_dir + "/ssm-" + clean_loc + "-" + str(id) + ".json"
 
-def write_map_to_file(dir, loc, map_id, d):
+def write_map_to_file(writer, dir, loc, map_id, d):
     """ Write a dict to an ssm .json file.
 
         Args:
+            writer: the ssm_writer.MapWriter that writes the file.
             dir: string path to directory.
             loc: string place name used to build file name.
             map_id: int used to build file name.
@@ -164,35 +129,42 @@ def write_map_to_file(dir, loc, map_id, d):
         Returns:
             Nothing
     """
-    if not os.path.exists(dir):
-        os.makedirs(dir)
     path = build_output_file_path(dir, loc, map_id)
-    with open(path, "w") as f:
-        json.dump(d, f, sort_keys=True, indent=4)
-        f.close()
+    writer.write(path, d, map_id)
 
 def main():
     IX_SSM_ID = 0
     IX_OWNER_ID = 1
-    IX_DOC = 2
-    IX_MODIFIED_AT = 4
-    IX_SSM_NAME = 5
+    IX_MODIFIED_AT = 2
+    IX_SSM_NAME = 3
+    IX_SIZE = 4
+    IX_ROLE = 5
+    IX_LABEL = 6
+    IX_DOC = 7
+    if len(sys.argv) < 2:
+        print "usage: get_mental_maps.py output_directory [dry_run]"
+        return
     dir = sys.argv[1]
-    maps = get_maps(IX_MODIFIED_AT)
-    n = 0
-    print_header()
-    for map in maps:
-        map_id = map[IX_SSM_ID]
-        owner = map[IX_OWNER_ID]
-        last_modified = map[IX_MODIFIED_AT].strftime("%Y-%m-%d %H:%M")
-        name = map[IX_SSM_NAME]
-        d = map[IX_DOC]
-        if "schoolLocation" in d and owner not in [2, 20]: # exclude SC, KHL
+    dry_run = (len(sys.argv) > 2 and
+               sys.argv[2] in ['t', 'T', "TRUE", "true", "True"])
+    maps = iter_map_summaries(label_key="schoolLocation",
+                              with_document=not dry_run,
+                              has_key="schoolLocation",
+                              exclude_owners=[2, 20]) # exclude SC, KHL
+    with MapWriter() as writer:
+        n = 0
+        print_header()
+        for map in maps:
+            map_id = map[IX_SSM_ID]
+            owner = map[IX_OWNER_ID]
+            last_modified = map[IX_MODIFIED_AT].strftime("%Y-%m-%d %H:%M")
+            name = map[IX_SSM_NAME]
             n += 1
-            sz = str(len(str(d)))
-            loc = str(d["schoolLocation"])
+            sz = str(map[IX_SIZE])
+            loc = str(map[IX_LABEL])
             print_row(n, loc, sz, last_modified)
-            write_map_to_file(dir, loc, map_id, d)
+            if not dry_run:
+                write_map_to_file(writer, dir, loc, map_id, map[IX_DOC])
 
 if __name__ == "__main__":
     main()
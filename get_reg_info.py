@@ -17,40 +17,16 @@
 import sys
 import os
 import collections
-import json
 import string
 import re
-import psycopg2
-from get_maps_by_version import connect, get_maps
+from ssm_utilities import iter_rows
 
-# Indices in "users" and "maps" tables in "ssm" PostgreSQL database:
+# Indices in "users" table in "ssm" PostgreSQL database:
 USERS_ID_IX = 0
 USERS_EMAIL_IX = 1
 USERS_NAME_IX = 5
 USERS_STATE_IX = 6
 USERS_REASON_IX = 13
-MAPS_ID_IX = 0
-MAPS_OWNER_ID = 1
-
-
-def get_users(sort_index):
-    """ Get a list of tuples from the PostgreSQL ssm database, each tuple of
-        which is a dict representing a registered ssm user.
-
-        Arg:
-            sort_index: the int index of the tuple elements to be used as the
-            basis for sorting the tuples in the list.
-
-        Returns:
-            a sorted list of tuples.
-    """
-    conn = connect()
-    cur = conn.cursor()
-    cur.execute("SELECT * from users")
-    users = cur.fetchall()
-    cur.close()
-    conn.close()
-    return sorted(users, key=lambda k: k[sort_index])
 
 
 def get_file_list(dir, suffix):
@@ -88,37 +64,24 @@ def get_ssm_ids(ssm_list):
     return ids
 
 
-def get_owner_id(map_id, maps):
-    """ Get the id of the owner of the ssm with id = map_id
+def build_reg_info_query(map_ids):
+    """ Build a query that joins each map to the registration data of its
+        owner, for only those maps whose ids are in map_ids.
 
-        Args:
-            map_id: the id of an ssm in the "maps" table of the "ssm" database.
-            maps: a list of tuples for each of which the element in position
-            MAPS_ID_IX is expected to be the integer id of an ssm and the
-            element in position MAPS_OWNER_ID is expected to be the integer id
-            of the owner of tghe ssm.
-
-        Returns:
-            the integer id of the owner
-   """
-    map = [map for map in maps if map[MAPS_ID_IX] == map_id]
-    return map[0][MAPS_OWNER_ID]
-
-
-def get_user_data(user_id, users):
-    """ Get all the registration data in the "users" table of the "ssm"
-        database for the user with id = user_id.
-
-        Args:
-            user_id: the id of the user whose registration data we seek.
-            users: a list of user registration data.
+        Arg:
+            map_ids: a list of integer map ids.
 
         Returns:
-            the registration data associated with the user with id = user_id
+            a (sql, params) tuple. Each row of the result is the map id and
+            its owner id, followed by the owner's row of the "users" table,
+            so that row[2:] can be indexed with the USERS_*_IX constants. A
+            map whose owner has no row in "users" still has a row, with NULL
+            users columns. There is one row per map, in no particular order.
     """
-    user_ix = [i for i, u in enumerate(users) if u[0] == user_id][0]
-    user_data = users[user_ix]
-    return user_data
+    sql = ("SELECT maps.id, maps.owner, users.* FROM maps "
+           "LEFT JOIN users ON users.id = maps.owner "
+           "WHERE maps.id = ANY(%s)")
+    return sql, [map_ids]
 
 
 def write_headers(outf):
@@ -142,14 +105,25 @@ def main():
 
     ssm_file_list = get_file_list(in_dir, ".json")
     map_file_ids = get_ssm_ids(ssm_file_list)
-    maps = get_maps(MAPS_ID_IX)
-    users = get_users(USERS_ID_IX)
+    sql, params = build_reg_info_query(map_file_ids)
 
+    # The query returns each map once, in any order; the report has a row per
+    # file, in the order of the file list:
+    owners = {}
+    for row in iter_rows(sql, params):
+        owners[row[0]] = row[1:]
     outf = open(out_fname, "w+")
     write_headers(outf)
     for map_id in map_file_ids:
-        owner_id = get_owner_id(map_id, maps)
-        owner_data = get_user_data(owner_id, users)
+        if map_id not in owners:
+            print "No map with id " + str(map_id) + " in the database."
+            continue
+        owner_id = owners[map_id][0]
+        owner_data = owners[map_id][1:]
+        if owner_data[USERS_ID_IX] is None:
+            print ("Map " + str(map_id) + ": no user with id " +
+                   str(owner_id) + " (its owner) in the database.")
+            continue
         write_owner_data(outf, map_id, owner_data)
     outf.close()
 
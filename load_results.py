@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+""" load_results.py: Load a directory of processed system support maps (e.g.,
+    the coded ssms written by add_codes_to_SSMs.py or the rcoded ssms written
+    by rlabels2rcodes.py) back into the ssm database, in bulk.
+
+    Usage:
+        load_results.py stage input_directory [batch_size]
+
+    Args:
+        stage: a short name for the pipeline stage that produced the files,
+        e.g. "coded" or "rcoded". Together with the map id it identifies a
+        row of the results table.
+        input_directory: a directory of processed ssm .json files, the names
+        of which end with the id of the source map in the "maps" table (any
+        suffix such as "-C" or "-rcoded" may follow it), as the extractors
+        and the later stages name them.
+        batch_size (optional): the number of files upserted per round trip
+        and per transaction. Default is 500.
+
+    The documents are upserted into table "ssm_results", which is created if
+    it doesn't exist:
+
+        CREATE TABLE ssm_results (
+            map_id    integer NOT NULL,
+            stage     text NOT NULL,
+            document  jsonb NOT NULL,
+            loaded_at timestamp NOT NULL DEFAULT now(),
+            PRIMARY KEY (map_id, stage)
+        )
+
+    A map that was already loaded for the same stage is overwritten. Each
+    batch is sent as a single multi-row INSERT ... ON CONFLICT statement (see
+    psycopg2.extras.execute_values) and committed on its own, so an error
+    leaves the batches before it loaded.
+
+    From directory of .json files:
+    -> read a batch of files
+    -> upsert the batch into ssm_results in one statement and transaction
+"""
+
+import sys
+import os
+import re
+import collections
+import psycopg2
+import psycopg2.extras
+from ssm_utilities import connect, get_file_list
+
+DEFAULT_BATCH_SIZE = 500
+
+CREATE_RESULTS_TABLE = """
+    CREATE TABLE IF NOT EXISTS ssm_results (
+        map_id    integer NOT NULL,
+        stage     text NOT NULL,
+        document  jsonb NOT NULL,
+        loaded_at timestamp NOT NULL DEFAULT now(),
+        PRIMARY KEY (map_id, stage)
+    )"""
+
+UPSERT_RESULTS = """
+    INSERT INTO ssm_results (map_id, stage, document, loaded_at) VALUES %s
+    ON CONFLICT (map_id, stage) DO UPDATE
+    SET document = EXCLUDED.document, loaded_at = EXCLUDED.loaded_at"""
+
+UPSERT_TEMPLATE = "(%s, %s, %s::jsonb, now())"
+
+
+def get_map_id(fn):
+    """ Get the integer map id from an ssm file name: the last run of digits
+        in the name, or None if there isn't one.
+    """
+    ints = re.findall(r'\d+', fn)
+    if not ints:
+        return None
+    return int(ints[-1])
+
+
+def iter_batches(paths, batch_size):
+    """ Split a list of paths into lists of at most batch_size paths.
+    """
+    for i in range(0, len(paths), batch_size):
+        yield paths[i:i + batch_size]
+
+
+def read_batch(stage, paths):
+    """ Read a batch of ssm files as rows for UPSERT_RESULTS.
+
+        Args:
+            stage: the stage name.
+            paths: a list of (map_id, path) tuples.
+
+        Returns:
+            a list of (map_id, stage, json_text) tuples, one per map id (if
+            two files in the batch have the same map id, the later wins, as it
+            would have across batches). The JSON text is sent as is and
+            parsed by the database.
+    """
+    rows = collections.OrderedDict()
+    for map_id, path in paths:
+        with open(path) as f:
+            rows[map_id] = (map_id, stage, f.read())
+    return rows.values()
+
+
+def load_batch(conn, rows):
+    """ Upsert a batch of rows into ssm_results in one statement, and commit.
+    """
+    cur = conn.cursor()
+    psycopg2.extras.execute_values(cur, UPSERT_RESULTS, rows,
+                                   template=UPSERT_TEMPLATE,
+                                   page_size=len(rows))
+    cur.close()
+    conn.commit()
+
+
+def main():
+    if len(sys.argv) < 3:
+        print "usage: load_results.py stage input_directory [batch_size]"
+        return
+    stage = sys.argv[1]
+    dir = sys.argv[2]
+    batch_size = DEFAULT_BATCH_SIZE
+    if len(sys.argv) > 3:
+        batch_size = int(sys.argv[3])
+    paths = []
+    for fn in sorted(get_file_list(dir, ".json")):
+        map_id = get_map_id(fn)
+        if map_id is None:
+            print "skipping " + fn + ": no map id in file name"
+            continue
+        paths.append((map_id, os.path.join(dir, fn)))
+    conn = connect()
+    if conn is None:
+        return
+    n = 0
+    n_files = 0
+    try:
+        cur = conn.cursor()
+        cur.execute(CREATE_RESULTS_TABLE)
+        cur.close()
+        conn.commit()
+        for batch in iter_batches(paths, batch_size):
+            rows = read_batch(stage, batch)
+            load_batch(conn, rows)
+            n += len(rows)
+            n_files += len(batch)
+            print str(n_files) + " of " + str(len(paths)) + " files loaded"
+    except (Exception, psycopg2.DatabaseError) as error:
+        print error
+        conn.rollback()
+    finally:
+        conn.close()
+    print ("\n" + str(n) + " \"" + stage + "\" maps loaded into ssm_results")
+
+
+if __name__ == "__main__":
+    main()
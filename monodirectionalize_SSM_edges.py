@@ -21,7 +21,8 @@
 
 import sys
 import os
-import json
+import ssm_json
+from ssm_graph import SSMGraph, STAR, ELLIPSE
 
 
 def print_node(n):
@@ -32,27 +33,14 @@ def print_node(n):
         print None
 
 
-def print_nodes(nodes, num):
+def print_nodes(graph, num):
     for i in range(0, num):
-        n = get_node(i, nodes)
+        ix = graph.index_of(i)
+        n = None if ix is None else graph.nodes[ix]
         print "------\nnode #" + str(i)
         print_node(n)
 
 
-def convert(input):
-    """ Convenience function to convert from unicode to ascii for easier
-        reading of diagnostic output. From https://stackoverflow.com/questions/13101653/python-convert-complex-dictionary-of-strings-from-unicode-to-ascii
-    """
-    if isinstance(input, dict):
-        return {convert(key): convert(value) for key, value in input.iteritems()}
-    elif isinstance(input, list):
-        return [convert(element) for element in input]
-    elif isinstance(input, unicode):
-        return input.encode('utf-8')
-    else:
-        return input
-
-
 def get_file_list(dir, suffix):
     """ Get a list of all the files (in "dir") whose names end in "suffix."
     Args:
@@ -104,22 +92,31 @@ def print_list(list, title):
         i += 1
 
 
-def get_node(id, nodes):
-    for n in nodes:
-        if n["id"] == id:
-            return n
-    return None
+def monodirectionalize_ssm(ssm, graph=None):
+    """ Find all Wish (star-shaped) and Resource (ellipsoidal) nodes in an SSM
+        dict. For each, find all links whose source is that node, and in each
+        of those links switch the values for "source" and "target".
 
+        Assumes that links for Wishes and Resources always point inwards, and
+        that all other links point outwards.
 
-def monodirectionalize_single_ssm(inpath, outpath):
-    """ Open the SSM file located at "inpath". Read it into a dict. Find all
-        Wish (star-shaped) and Resource (ellipsoidal) nodes. For each, find all
-        links whose source is that node, and in each of those links switch the
-        values for "source" and "target". Write the monodirectionalized dict as
-        an SSM to outpath.
+        Args:
+            ssm: an SSM dict; its links are changed in place.
+            graph (optional): the SSMGraph of ssm, if the caller has one.
 
-        Assumes that links for Wishes and Resources always point inwards, and 
-        that all other links point outwards.
+        Returns:
+            the SSM dict.
+    """
+    if graph is None:
+        graph = SSMGraph(ssm)
+    graph.reverse_links(graph.links_from_shapes((STAR, ELLIPSE)))
+    return ssm
+
+
+def monodirectionalize_single_ssm(inpath, outpath):
+    """ Open the SSM file located at "inpath". Read it into a dict,
+        monodirectionalize it (see monodirectionalize_ssm) and write the
+        monodirectionalized dict as an SSM to outpath.
 
         Args:
             inpath: full path to an SSM file to be monodirectionalized.
@@ -129,23 +126,13 @@ def monodirectionalize_single_ssm(inpath, outpath):
         Returns:
             None
     """
-    with open(inpath) as json_input_file:
-        json_object = json.load(json_input_file)
-    json_object = convert(json_object)
+    json_object = ssm_json.load(inpath)
     links = json_object["links"]
     nodes = json_object["nodes"]
     print ("inpath: " + inpath + "; " + str(len(links)) + " links; " +
            str(len(nodes)) + " nodes")
-    for link in links:
-        source_id = link["source"]
-        print "source_id: " + str(source_id)
-        source_node = [node for node in nodes if node["id"] == source_id][0]
-        if source_node["shape"] in ["star", "ellipse"]:
-            temp = link["source"]
-            link["source"] = link["target"]
-            link["target"] = temp
-    with open(outpath, "w") as outfile:
-        json.dump(json_object, outfile)
+    monodirectionalize_ssm(json_object)
+    ssm_json.dump(json_object, outpath)
 
 
 def main():
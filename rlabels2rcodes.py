@@ -9,6 +9,10 @@
 
     No rlabels in input? No error, just no rcodes in output. 
 
+    SSMs rlabeled with plain_names (see add_rlabels_to_SSMs.py) keep their
+    rlabels only in each node's "rlabels" list, so their names are used as
+    they are instead of being split at the first rlabel.
+
     Usage:
         rlabels2rcodes.py path/to/sorted_resp_file
                           rlabeled_ssm_dir
@@ -21,16 +25,34 @@
 	    rlabeled_ssm_dir except that every rlabel in every SSM has been
 	    replaced by its corresponding rcode.
 
+    The rcode lookup built from sorted_resp_file is cached next to it, in
+    hidden file ".<sorted_resp_file name>.rcodes.cache", and reused for as
+    long as the file is unchanged.
+
 
 
 """
 
 import sys
 import os
+import re
+import collections
+import hashlib
+import cPickle
 import csv
-import json
 import numpy as np
 import pandas as pd
+import ssm_json
+from add_rlabels_to_SSMs import RLABELS_IN_NAMES_KEY
+
+# An rlabel as appended by add_rlabels_to_SSMs.py, e.g., "[r4-1000]":
+RLABEL_TOKEN = re.compile(r"\[r[^\[\]]*\]")
+
+# The compiled rcode lookup of a sorted responsibilities file is cached in a
+# hidden file next to it (see load_rcode_lookup); bump the version whenever
+# build_rcode_lookup's output changes:
+RCODE_CACHE_SUFFIX = ".rcodes.cache"
+RCODE_CACHE_VERSION = 2
 
 
 def get_file_list(dir, suffix):
@@ -90,40 +112,183 @@ def print_list(list, title):
         i += 1
 
 
-def convert(input):
-    """ Convenience function to convert from unicode to utf-8 for easier
-        reading of diagnostic output. From https://stackoverflow.com/questions/13101653/python-convert-complex-dictionary-of-strings-from-unicode-to-ascii
+def build_automaton(patterns):
+    """ Build an Aho-Corasick automaton that finds every occurrence of any of
+        a set of strings in one pass over a text.
+
+    Args:
+        patterns: the strings to look for.
+
+    Returns:
+        a (goto, fail, out) tuple: per state, its transitions (a dict from
+        character to state), its failure state, and the patterns that end
+        there. State 0 is the root.
     """
-    if isinstance(input, dict):
-        return {convert(key): convert(value) for key, value in input.iteritems()}
-    elif isinstance(input, list):
-        return [convert(element) for element in input]
-    elif isinstance(input, unicode):
-        return input.encode('utf-8')
-    else:
-        return input
+    goto = [{}]
+    out = [[]]
+    for pattern in patterns:
+        state = 0
+        for ch in pattern:
+            if ch not in goto[state]:
+                goto.append({})
+                out.append([])
+                goto[state][ch] = len(goto) - 1
+            state = goto[state][ch]
+        out[state].append(pattern)
+    fail = [0] * len(goto)
+    queue = collections.deque(goto[0].values())
+    while queue:
+        state = queue.popleft()
+        for ch, next_state in goto[state].iteritems():
+            queue.append(next_state)
+            f = fail[state]
+            while f and ch not in goto[f]:
+                f = fail[f]
+            fail[next_state] = goto[f].get(ch, 0)
+            out[next_state] = out[next_state] + out[fail[next_state]]
+    return goto, fail, out
+
+
+def find_patterns(automaton, text):
+    """ The set of the automaton's patterns (see build_automaton) that occur
+        in text.
+    """
+    goto, fail, out = automaton
+    found = set()
+    state = 0
+    for ch in text:
+        while state and ch not in goto[state]:
+            state = fail[state]
+        state = goto[state].get(ch, 0)
+        found.update(out[state])
+    return found
 
 
 def build_rcode_lookup(rcodepath):
+    """ Read a sorted responsibilities file and index it by rlabel.
+
+    Args:
+        rcodepath: path to a file of responsibility node texts, sorted by
+            codes (see module docstring).
+
+    Returns:
+        a dict with:
+            "rlabels": a dict from each rlabel token found in a text item to
+                the rcode (the code title) of that text item.
+            "texts": a list of (text, rcode) tuples, for the rlabels that
+                don't tokenize cleanly (see resolve_untokenized_rlabels).
+            "untokenized": a dict of those rlabels already resolved, to their
+                rcode or None.
+        Where an rlabel is in more than one text item, the first one in
+        "texts" gives its rcode, as a substring search over them would.
+    """
     rcode_lookup = {}
-    with open(rcodepath) as f:
-        dct = convert(json.load(f))
+    dct = ssm_json.load(rcodepath)
     print "\nResponsibilities dict:"
     for rlist in dct["sorted"]:
         rcode = rlist["title"]
-        rcl = []
-        print "rcode: " + rcode
+        print "rcode: " + ssm_json.printable(rcode)
         for ti in rlist["textItems"]:
             rcode_lookup[ti["text"]] = rcode
-            print ti["text"]
+            print ssm_json.printable(ti["text"])
         print "\n"
     print "\n"
+    texts = rcode_lookup.items()
+    rlabels = {}
+    for text, rcode in texts:
+        for token in RLABEL_TOKEN.findall(text):
+            rlabels.setdefault(token, rcode)
+    return {"rlabels": rlabels, "texts": texts, "untokenized": {}}
+
+
+def get_rcode_cache_path(rcodepath):
+    """ The path of the rcode lookup cache for a sorted responsibilities file.
+    """
+    dir, fname = os.path.split(rcodepath)
+    return os.path.join(dir, "." + fname + RCODE_CACHE_SUFFIX)
+
+
+def load_rcode_lookup(rcodepath):
+    """ Get the rcode lookup (see build_rcode_lookup) for a sorted
+        responsibilities file from its cache, if the cache was built from the
+        same file contents by the same version of build_rcode_lookup.
+        Otherwise build it and replace the cache, atomically; a cache that
+        can't be written is skipped.
+
+    Args:
+        rcodepath: path to a file of responsibility node texts, sorted by
+            codes.
+
+    Returns:
+        the rcode lookup.
+    """
+    with open(rcodepath, "rb") as f:
+        sha1 = hashlib.sha1(f.read()).hexdigest()
+    cachepath = get_rcode_cache_path(rcodepath)
+    try:
+        with open(cachepath, "rb") as f:
+            cache = cPickle.load(f)
+        if (cache["version"] == RCODE_CACHE_VERSION and
+                cache["sha1"] == sha1):
+            print "rcode lookup loaded from " + cachepath
+            return cache["lookup"]
+    except (IOError, EOFError, KeyError, TypeError, cPickle.UnpicklingError):
+        pass
+    rcode_lookup = build_rcode_lookup(rcodepath)
+    cache = {"version": RCODE_CACHE_VERSION, "sha1": sha1,
+             "lookup": rcode_lookup}
+    try:
+        with open(cachepath + ".tmp", "wb") as f:
+            cPickle.dump(cache, f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(cachepath + ".tmp", cachepath)
+    except (IOError, OSError) as error:
+        print "rcode lookup not cached: " + str(error)
     return rcode_lookup
 
 
+def is_token(rlabel):
+    """ True if rlabel tokenizes cleanly, i.e., has no brackets within it (as
+        it may if it was built from a full file name).
+    """
+    match = RLABEL_TOKEN.match(rlabel)
+    return match is not None and match.end() == len(rlabel)
+
+
+def resolve_untokenized_rlabels(rcode_lookup, rlabels):
+    """ Find the rcodes of the rlabels that aren't tokens (see is_token) and
+        haven't been looked up before, with one multi-pattern search over the
+        text items, and add them to rcode_lookup["untokenized"].
+
+    Args:
+        rcode_lookup: as returned by build_rcode_lookup.
+        rlabels: the rlabels about to be looked up.
+    """
+    resolved = rcode_lookup["untokenized"]
+    patterns = set(rlabel for rlabel in rlabels
+                   if rlabel not in resolved and not is_token(rlabel))
+    if not patterns:
+        return
+    automaton = build_automaton(patterns)
+    for text, rcode in rcode_lookup["texts"]:
+        for rlabel in find_patterns(automaton, text):
+            resolved.setdefault(rlabel, rcode)
+    for rlabel in patterns:
+        resolved.setdefault(rlabel, None)
+
+
+def get_rcode(rcode_lookup, rlabel):
+    """ The rcode of rlabel, or None if it isn't in any sorted text item. An
+        rlabel that isn't a token must have been passed to
+        resolve_untokenized_rlabels first.
+    """
+    rcode = rcode_lookup["rlabels"].get(rlabel)
+    if rcode is None:
+        rcode = rcode_lookup["untokenized"].get(rlabel)
+    return rcode
+
+
 def open_ssm(inpath):
-    ssm = open(inpath).read()
-    return convert(json.loads(ssm))
+    return ssm_json.load(inpath)
 
 
 def replace_rlabels_with_rcodes(rcode_lookup, ssm):
@@ -132,9 +297,7 @@ def replace_rlabels_with_rcodes(rcode_lookup, ssm):
         rcode_lookup.
     
     Args:
-        rcode_lookup: set of key-value pairs where the key is a code and its 
-            corresponding value is a node text item that typically has one or
-            more rlabels appended.
+        rcode_lookup: the rlabel index built by build_rcode_lookup.
         ssm: a JSON-encoded System Support Map that, if this function is to be
             useful, includes rlabels.
     
@@ -142,30 +305,31 @@ def replace_rlabels_with_rcodes(rcode_lookup, ssm):
         has been replaced with its corresponding rcode.
     """
     rcoded_ssm = ssm 
-    keys = rcode_lookup.keys()
-    print keys
     nodes = rcoded_ssm["nodes"]
+    resolve_untokenized_rlabels(
+        rcode_lookup, [rlabel for node in nodes
+                       for rlabel in node.get("rlabels", [])])
     for node in nodes:
-        n_rlabels = len(node["rlabels"])
+        n_rlabels = len(node.get("rlabels", []))
         print "#rlabels: " + str(n_rlabels)
-        print "node name: " + node["name"]
-        delabeled = node["name"].split(" [r", 1)[0]
-        print "delabeled: " + delabeled
+        print "node name: " + ssm_json.printable(node["name"])
+        if ssm.get(RLABELS_IN_NAMES_KEY, True):
+            delabeled = node["name"].split(" [r", 1)[0]
+        else:  # rlabeled with plain_names: nothing to strip
+            delabeled = node["name"]
+        print "delabeled: " + ssm_json.printable(delabeled)
         new_name = delabeled
-        for rlabel in node["rlabels"]:
-            print rlabel
-            for key in keys:
-                if rlabel in key:
-                    rcode = rcode_lookup[key]
-                    new_name = new_name + " {rcode " + rcode + "}"
-                    break
+        for rlabel in node.get("rlabels", []):
+            print ssm_json.printable(rlabel)
+            rcode = get_rcode(rcode_lookup, rlabel)
+            if rcode is not None:
+                new_name = new_name + " {rcode " + rcode + "}"
         node["name"] = new_name
     return rcoded_ssm
 
     
 def write_ssm_to_file(ssm, filepath):
-    with open(filepath, "w") as fp:
-        json.dump(ssm, fp)
+    ssm_json.dump(ssm, filepath)
 
 
 def main():
@@ -190,7 +354,7 @@ def main():
     infiles = get_file_list(rlabeled_ssm_dir, ".json")
     inpathlist = build_path_list(rlabeled_ssm_dir, infiles)
     outpathlist = build_rcoded_ssm_path_list(infiles, rcoded_ssm_dir)
-    rcode_lookup = build_rcode_lookup(sorted_resp_file_path)
+    rcode_lookup = load_rcode_lookup(sorted_resp_file_path)
     width = 3
     for i, inpath in enumerate(inpathlist):
       print "in:  %s. %s" % (str(i).rjust(width), inpath)
@@ -57,30 +57,18 @@ else
   exit 1
 fi
 
-# Now we want to run the mono-directionalize code.
-MONO_DIRECTIONALIZED_DIR=${PROJECT_HOME}/1-ssm-monodir
-[ -d "$MONO_DIRECTIONALIZED_DIR" ] || mkdir $MONO_DIRECTIONALIZED_DIR
-
-MONO_EXECUTABLE=${SSM_BIN_HOME}/ssm_processing/monodirectionalize_SSM_edges.py
-${MONO_EXECUTABLE} $SSM_DIR $MONO_DIRECTIONALIZED_DIR
-if [ $? -eq 0 ]
-then
-  echo "Successfully monodirectionalized SSM files"
-else
-  echo "Could not monodirectionalize SSM files" >&2
-  exit 1
-fi
-
-# Next is add_rlabels_to_SSMs.py
+# Now we monodirectionalize and rlabel the SSMs, in one pass that doesn't
+# write the monodirectionalized SSMs. To keep them too (e.g., for debugging),
+# set SSM_MONODIR_DIR; for example: export SSM_MONODIR_DIR=${PROJECT_HOME}/1-ssm-monodir
 RLABELED_DIR=${PROJECT_HOME}/2-ssm-monodir-rlabeled
 [ -d "$RLABELED_DIR" ] || mkdir $RLABELED_DIR
-RLABEL_EXECUTABLE=${SSM_BIN_HOME}/ssm_processing/add_rlabels_to_SSMs.py
-${RLABEL_EXECUTABLE} $MONO_DIRECTIONALIZED_DIR $RLABELED_DIR TRUE
+STAGE1_EXECUTABLE=${SSM_BIN_HOME}/ssm_processing/run_stage1.py
+${STAGE1_EXECUTABLE} $SSM_DIR $RLABELED_DIR TRUE
 if [ $? -eq 0 ]
 then
-  echo "Successfully rlabeled SSM files"
+  echo "Successfully monodirectionalized and rlabeled SSM files"
 else
-  echo "Could not rlabel SSM files" >&2
+  echo "Could not monodirectionalize and rlabel SSM files" >&2
   exit 1
 fi
 
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+
+""" run_stage1.py: Monodirectionalize and rlabel a directory of System Support
+    Maps (SSMs) in one pass, as monodirectionalize_SSM_edges.py followed by
+    add_rlabels_to_SSMs.py would, but loading each SSM once and applying both
+    steps (and optionally add_codes_to_SSMs.py) to it in memory, on one
+    SSMGraph, instead of writing and re-reading a directory of JSON files
+    between the steps.
+
+    Usage:
+        run_stage1.py indir outdir [use_full_filename] [undir]
+
+    Args:
+        indir: String path to a directory of SSM files ending with extension
+            ".json".
+        outdir: String path to a directory for the rlabeled SSMs, named as
+            add_rlabels_to_SSMs.py names them after monodirectionalization:
+            "<name>-monodir-rlabeled.json". Created if it doesn't exist.
+        use_full_filename, undir (optional): Booleans, as for
+            add_rlabels_to_SSMs.py. Rlabels are built from the name of the
+            monodirectionalized file ("<name>-monodir.json"), as they are
+            when the two scripts are run one after the other.
+        plain_names (optional): Boolean. Not supported: if true, nothing is
+            done. runSSM.sh hands the rlabeled SSMs to blm.R, which takes the
+            rlabels from the node names, so without them its BLMs would have
+            no rlabels for Stage 2 (rlabels2rcodes.py) to resolve.
+
+    Environment variables select the other, optional outputs:
+        SSM_MONODIR_DIR: if set, also write the monodirectionalized SSMs
+            there, as monodirectionalize_SSM_edges.py would (e.g., to debug).
+        SSM_CBLM_DIR, SSM_CSSM_DIR: if both are set, also add the codes from
+            the CBLM of each rlabeled SSM, "<rlabeled name>-CBLM.csv" in
+            SSM_CBLM_DIR, and write the coded SSM, "<rlabeled name>-C.json",
+            to SSM_CSSM_DIR, as add_codes_to_SSMs.py would. An SSM without a
+            CBLM is not coded.
+"""
+
+import sys
+import os
+import ntpath
+import ssm_json
+from ssm_graph import SSMGraph
+import monodirectionalize_SSM_edges
+import add_rlabels_to_SSMs
+import add_codes_to_SSMs
+
+
+def get_optional_dir(name):
+    """ The directory named by environment variable "name", created if need
+        be, or None if the variable isn't set.
+    """
+    dir = os.environ.get(name)
+    if not dir:
+        return None
+    if not os.path.exists(dir):
+        os.makedirs(dir)
+        print "Created " + dir
+    return dir
+
+
+def run_stage1_single_ssm(inpath, outpath, monodir_path, options,
+                          monodir_dir=None, cblm_path=None, cssm_path=None):
+    """ Monodirectionalize and rlabel the SSM file at inpath (and code it, if
+        given a CBLM) and write the results.
+
+        Args:
+            inpath: full path to an SSM file.
+            outpath: full path of the rlabeled SSM file to write.
+            monodir_path: full path of the monodirectionalized SSM file, whose
+                name the rlabels are built from.
+            options: the add_rlabels_to_SSMs.RlabelOptions.
+            monodir_dir: if not None, write the monodirectionalized SSM to
+                monodir_path (which is in that directory).
+            cblm_path, cssm_path: if not None, the CBLM file to take codes
+                from, and the full path of the coded SSM file to write.
+
+        Returns:
+            None
+    """
+    ssm = ssm_json.load(inpath)
+    print ("inpath: " + inpath + "; " + str(len(ssm["links"])) + " links; " +
+           str(len(ssm["nodes"])) + " nodes")
+    graph = SSMGraph(ssm)
+    monodirectionalize_SSM_edges.monodirectionalize_ssm(ssm, graph)
+    if monodir_dir is not None:
+        ssm_json.dump(ssm, monodir_path)
+    add_rlabels_to_SSMs.add_rlabels_to_ssm(ssm, ntpath.basename(monodir_path),
+                                           graph, options)
+    ssm_json.dump(ssm, outpath)
+    if cblm_path is not None:
+        add_codes_to_SSMs.add_codes_to_ssm(
+            ssm, add_codes_to_SSMs.read_cblm(cblm_path), graph)
+        ssm_json.dump(ssm, cssm_path)
+
+
+def main():
+    if len(sys.argv) < 3:
+        print ("usage: run_stage1.py indir outdir " +
+               "[use_full_filename] [undir]")
+        return
+    indir = sys.argv[1]
+    outdir = sys.argv[2]
+    flags = [len(sys.argv) > i and
+             sys.argv[i] in ['t', 'T', "TRUE", "true", "True"]
+             for i in (3, 4, 5)]
+    if flags[2]:
+        print ("Input error: plain_names is not supported; blm.R needs the " +
+               "rlabels in the node names. Exiting.")
+        return
+    options = add_rlabels_to_SSMs.RlabelOptions(*flags)
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+        print "Created " + outdir
+
+    monodir_dir = get_optional_dir("SSM_MONODIR_DIR")
+    cblm_dir = os.environ.get("SSM_CBLM_DIR")
+    cssm_dir = os.environ.get("SSM_CSSM_DIR") and cblm_dir and \
+        get_optional_dir("SSM_CSSM_DIR")
+
+    infiles = monodirectionalize_SSM_edges.get_file_list(indir, ".json")
+    inpathlist = monodirectionalize_SSM_edges.build_path_list(indir, infiles)
+    monodir_paths = \
+        monodirectionalize_SSM_edges.build_monodirectionalized_ssm_path_list(
+            infiles, monodir_dir or outdir)
+    monodir_files = [ntpath.basename(path) for path in monodir_paths]
+    outpathlist = add_rlabels_to_SSMs.build_rlabeled_ssm_path_list(
+        monodir_files, outdir)
+    for inpath, monodir_path, outpath in zip(inpathlist, monodir_paths,
+                                             outpathlist):
+        cblm_path = cssm_path = None
+        if cssm_dir:
+            name = ntpath.basename(outpath)[:-5]
+            cblm_path = os.path.join(cblm_dir, name + "-CBLM.csv")
+            if os.path.isfile(cblm_path):
+                cssm_path = os.path.join(cssm_dir, name + "-C.json")
+            else:
+                print "No CBLM " + cblm_path + "; not coded"
+                cblm_path = None
+        run_stage1_single_ssm(inpath, outpath, monodir_path, options,
+                              monodir_dir, cblm_path, cssm_path)
+
+
+if __name__ == "__main__":
+    main()
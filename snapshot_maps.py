@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+""" snapshot_maps.py: Dump the "maps" and "users" tables of the ssm database
+    into a local snapshot directory, so that later extractions can run at
+    local-disk speed and without a database connection.
+
+    Usage:
+        snapshot_maps.py snapshot_dir
+
+    Arg:
+        snapshot_dir: the directory into which the snapshot is to be written.
+        If it doesn't exist it will be created. An earlier snapshot in the
+        same directory is replaced.
+
+    The snapshot consists of three files:
+
+        maps.ndjson:   one JSON array per line for each row of "maps", in
+                       ascending order of last modified timestamp.
+        users.ndjson:  one JSON array per line for each row of "users".
+        snapshot.json: the freshness stamp: when the snapshot was taken and
+                       how many rows of each table it holds.
+
+    To have ssm_utilities.get_maps(), get_users(), iter_maps() and
+    iter_map_summaries() (and so all the extractors) read from the snapshot
+    instead of the database, set environment variable SSM_SNAPSHOT_DIR to
+    snapshot_dir. The snapshot is used only while it is no more than
+    SSM_SNAPSHOT_MAX_AGE hours old (default 24); after that the database is
+    queried as usual. For example:
+
+        snapshot_maps.py ~/ssm-snapshot
+        export SSM_SNAPSHOT_DIR=~/ssm-snapshot
+        get_maps_by_version.py 3 out/v3
+"""
+
+import sys
+import os
+import time
+import json
+from ssm_utilities import SNAPSHOT_META_FILE, SNAPSHOT_MAPS_FILE, \
+    SNAPSHOT_USERS_FILE, build_maps_query, iter_rows, encode_snapshot_row
+
+
+def write_table(dir, fname, rows):
+    """ Write rows to dir/fname as NDJSON, replacing any earlier file only
+        once all rows have been written.
+
+        Returns:
+            the number of rows written.
+    """
+    path = os.path.join(dir, fname)
+    n = 0
+    with open(path + ".tmp", "w") as f:
+        for row in rows:
+            f.write(encode_snapshot_row(row) + "\n")
+            n += 1
+    os.rename(path + ".tmp", path)
+    return n
+
+
+def main():
+    if len(sys.argv) < 2:
+        print "usage: snapshot_maps.py snapshot_dir"
+        return
+    dir = sys.argv[1]
+    if not os.path.exists(dir):
+        os.makedirs(dir)
+        print "Created " + dir
+
+    taken_at = time.time()
+    # Read the database directly, never an older snapshot:
+    sql, params = build_maps_query()
+    n_maps = write_table(dir, SNAPSHOT_MAPS_FILE, iter_rows(sql, params))
+    print str(n_maps) + " maps written to " + SNAPSHOT_MAPS_FILE
+    n_users = write_table(dir, SNAPSHOT_USERS_FILE,
+                          iter_rows("SELECT * FROM users ORDER BY 1"))
+    print str(n_users) + " users written to " + SNAPSHOT_USERS_FILE
+
+    meta = {
+        "taken_at": taken_at,
+        "taken_at_text": time.strftime("%Y-%m-%d %H:%M:%S",
+                                       time.localtime(taken_at)),
+        "maps": n_maps,
+        "users": n_users
+    }
+    path = os.path.join(dir, SNAPSHOT_META_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(meta, f, sort_keys=True, indent=4)
+    os.rename(path + ".tmp", path)
+    print "Snapshot taken " + meta["taken_at_text"]
+
+
+if __name__ == "__main__":
+    main()
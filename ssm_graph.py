@@ -0,0 +1,259 @@
+#!/usr/bin/env python
+
+""" ssm_graph.py: An array-backed view of a System Support Map (SSM) for the
+    processing stages (monodirectionalize_SSM_edges.py, add_rlabels_to_SSMs.py,
+    add_codes_to_SSMs.py), built once per map.
+
+    The node and link dicts of the SSM are left where they are, and are still
+    what gets written out; the graph adds dense node indices (positions in
+    ssm["nodes"]) and NumPy arrays over them:
+
+        shape: int8 shape code of each node (see SHAPES).
+        code: the "code" of each node (see set_code), or None.
+        src, tgt: the node indices of each link's source and target, or -1
+            where a link refers to a node id that is not in the map.
+        out_ptr, out_links: CSR out-adjacency. The links whose source is node
+            i are out_links[out_ptr[i]:out_ptr[i + 1]], in document order.
+        in_ptr, in_links: CSR in-adjacency, likewise by target.
+
+    The adjacency is built on first use, so that a stage that only needs the
+    columns (e.g., monodirectionalize_ssm) doesn't pay for it.
+
+    Node lookups follow the stages' old get_node(): a node id resolves to the
+    first node that has it, and links are attached to that node. A link with
+    an unknown endpoint is left out of the adjacency.
+
+    Typical use:
+
+        graph = SSMGraph(ssm)
+        for t in graph.targets(graph.index_of(node_id)):
+            print graph.nodes[t]["name"]
+"""
+
+import numpy as np
+
+# Shape codes; any other (or no) shape is NO_SHAPE:
+SHAPES = ("circle", "rectangle", "star", "ellipse")
+NO_SHAPE = -1
+CIRCLE, RECTANGLE, STAR, ELLIPSE = range(len(SHAPES))
+SHAPE_CODES = dict((shape, code) for code, shape in enumerate(SHAPES))
+
+
+def build_csr(ends, n):
+    """ Build a CSR index of links by one of their ends.
+
+        Args:
+            ends: int array of the node index at that end of each link, or -1.
+            n: the number of nodes.
+
+        Returns:
+            a (ptr, links) tuple of int arrays: the links at node i are
+            links[ptr[i]:ptr[i + 1]], in ascending order.
+    """
+    known = np.flatnonzero(ends >= 0)
+    links = known[np.argsort(ends[known], kind="mergesort")]
+    ptr = np.zeros(n + 1, dtype=np.intp)
+    np.cumsum(np.bincount(ends[known], minlength=n), out=ptr[1:])
+    return ptr, links
+
+
+class SSMGraph(object):
+    """ Dense, array-backed graph of one SSM dict (see module docstring).
+    """
+
+    def __init__(self, ssm):
+        """ Arg:
+                ssm: an SSM dict, with "nodes" and "links" lists.
+        """
+        self.ssm = ssm
+        self.nodes = ssm["nodes"]
+        self.links = ssm["links"]
+        n = len(self.nodes)
+        self.id_to_index = {}
+        for i, node in enumerate(self.nodes):
+            self.id_to_index.setdefault(node["id"], i)
+        self.text_id_to_index = None
+        # The node that stands in for each node in the adjacency (itself,
+        # unless an earlier node has the same id):
+        self.canonical = np.array([self.id_to_index[node["id"]]
+                                   for node in self.nodes], dtype=np.intp)
+        self.shape = np.array([SHAPE_CODES.get(node.get("shape"), NO_SHAPE)
+                               for node in self.nodes], dtype=np.int8)
+        self.code = np.array([node.get("code") for node in self.nodes],
+                             dtype=object)
+        self.src = np.array([self.id_to_index.get(link["source"], -1)
+                             for link in self.links], dtype=np.intp)
+        self.tgt = np.array([self.id_to_index.get(link["target"], -1)
+                             for link in self.links], dtype=np.intp)
+        self._reset_adjacency()
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def index_of(self, id):
+        """ The index of the first node with id "id", or None.
+        """
+        return self.id_to_index.get(id)
+
+    def index_of_text(self, text):
+        """ The index of the first node whose id, as a string, is "text" (as
+            in a CBLM file), or None.
+        """
+        if self.text_id_to_index is None:
+            self.text_id_to_index = {}
+            for i, node in enumerate(self.nodes):
+                self.text_id_to_index.setdefault(str(node["id"]), i)
+        return self.text_id_to_index.get(text)
+
+    def _reset_adjacency(self):
+        self.out_ptr = self.out_links = None
+        self.in_ptr = self.in_links = None
+        self.undir_ptr = self.undir_nodes = None
+        self.adjacency_lists = {}
+
+    def _build_adjacency(self):
+        n = len(self.nodes)
+        linked = (self.src >= 0) & (self.tgt >= 0)
+        self.out_ptr, self.out_links = build_csr(np.where(linked, self.src, -1),
+                                                 n)
+        self.in_ptr, self.in_links = build_csr(np.where(linked, self.tgt, -1),
+                                               n)
+
+    def out_links_of(self, i):
+        """ The indices of the links whose source is node i.
+        """
+        if self.out_ptr is None:
+            self._build_adjacency()
+        c = self.canonical[i]
+        return self.out_links[self.out_ptr[c]:self.out_ptr[c + 1]]
+
+    def in_links_of(self, i):
+        """ The indices of the links whose target is node i.
+        """
+        if self.in_ptr is None:
+            self._build_adjacency()
+        c = self.canonical[i]
+        return self.in_links[self.in_ptr[c]:self.in_ptr[c + 1]]
+
+    def targets(self, i):
+        """ The node indices of the targets of node i's out-links, in link
+            order (repeated if there are parallel links).
+        """
+        return self.tgt[self.out_links_of(i)]
+
+    def sources(self, i):
+        """ The node indices of the sources of node i's in-links, in link
+            order.
+        """
+        return self.src[self.in_links_of(i)]
+
+    def neighbors(self, i):
+        """ The node indices at the other end of every link at node i,
+            ignoring direction: in link order and, for one link, the target
+            before the source (as if each link were followed by its reverse).
+        """
+        if self.undir_ptr is None:
+            self._build_undirected_adjacency()
+        c = self.canonical[i]
+        return self.undir_nodes[self.undir_ptr[c]:self.undir_ptr[c + 1]]
+
+    def _build_undirected_adjacency(self):
+        both = np.flatnonzero((self.src >= 0) & (self.tgt >= 0))
+        # Each link at both of its ends, in link order, then CSR by end:
+        ends = np.empty(2 * len(both), dtype=np.intp)
+        others = np.empty(2 * len(both), dtype=np.intp)
+        ends[0::2] = self.src[both]
+        others[0::2] = self.tgt[both]
+        ends[1::2] = self.tgt[both]
+        others[1::2] = self.src[both]
+        self.undir_ptr, order = build_csr(ends, len(self.nodes))
+        self.undir_nodes = others[order]
+
+    def target_lists(self):
+        """ The targets (see targets()) of every node, as a list of lists of
+            ints, for traversals that visit nodes one at a time.
+        """
+        return self._get_adjacency_lists("targets")
+
+    def source_lists(self):
+        """ The sources (see sources()) of every node, as a list of lists.
+        """
+        return self._get_adjacency_lists("sources")
+
+    def neighbor_lists(self):
+        """ The neighbors (see neighbors()) of every node, as a list of lists.
+        """
+        return self._get_adjacency_lists("neighbors")
+
+    def _get_adjacency_lists(self, kind):
+        if kind not in self.adjacency_lists:
+            of = getattr(self, kind)
+            lists = {}
+            for c in self.canonical:
+                if c not in lists:
+                    lists[c] = of(c).tolist()
+            # A node with a duplicate id shares the list of the first one:
+            self.adjacency_lists[kind] = [lists[c] for c in self.canonical]
+        return self.adjacency_lists[kind]
+
+    def components(self, exclude):
+        """ Label the connected components of the graph, ignoring link
+            direction, with the nodes in "exclude" left out: they are each a
+            component of their own and connect nothing. Uses union-find with
+            path halving over the links, so it is near-linear.
+
+            Arg:
+                exclude: bool array over the nodes.
+
+            Returns:
+                a list of ints, the component of each node: the index of one
+                of its nodes. A node with a duplicate id (see index_of) has
+                no links and is a component of its own.
+        """
+        parent = range(len(self.nodes))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        keep = (self.src >= 0) & (self.tgt >= 0)
+        keep[keep] = ~(exclude[self.src[keep]] | exclude[self.tgt[keep]])
+        for a, b in zip(self.src[keep].tolist(), self.tgt[keep].tolist()):
+            a = find(a)
+            b = find(b)
+            if a != b:
+                parent[b] = a
+        return [find(i) for i in range(len(self.nodes))]
+
+    def nodes_with_shape(self, shape):
+        """ The indices of the nodes with shape code "shape", in order.
+        """
+        return np.flatnonzero(self.shape == shape)
+
+    def links_from_shapes(self, shapes):
+        """ A boolean mask of the links whose source node has one of the shape
+            codes in "shapes".
+        """
+        known = self.src >= 0
+        mask = np.zeros(len(self.links), dtype=bool)
+        mask[known] = np.in1d(self.shape[self.src[known]], shapes)
+        return mask
+
+    def reverse_links(self, mask):
+        """ Swap the source and target of the links selected by boolean mask
+            "mask": the two columns in one step, and the "source" and "target"
+            of each selected link dict.
+        """
+        self.src[mask], self.tgt[mask] = self.tgt[mask], self.src[mask]
+        for k in np.flatnonzero(mask):
+            link = self.links[k]
+            link["source"], link["target"] = link["target"], link["source"]
+        self._reset_adjacency()
+
+    def set_code(self, i, code):
+        """ Set the "code" of node i, both in the array and in its dict.
+        """
+        self.code[i] = code
+        self.nodes[i]["code"] = code
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+
+""" ssm_json.py: Shared loading of System Support Map (SSM) JSON files for the
+    processing stages (monodirectionalize_SSM_edges.py, add_rlabels_to_SSMs.py,
+    rlabels2rcodes.py).
+
+    The stages used to pass every document they loaded through a recursive
+    convert(), which rebuilt every dict and list in order to turn each unicode
+    string into a utf-8 str, only so that diagnostic output would print. The
+    loaded documents now keep their unicode strings, which is what the stages
+    need (names and rlabels are concatenated and compared as text, and
+    json.dump writes unicode and utf-8 strs alike), and strings are encoded
+    only where they are printed, with printable():
+
+        ssm = ssm_json.load(inpath)
+        print "name: " + ssm_json.printable(ssm["nodes"][0]["name"])
+
+    Strings that come from outside a document, such as file names, are decoded
+    with text() before they are combined with the document's strings.
+
+    This is also the one JSON codec of the stages and the extractors:
+
+        Parsing uses the fastest parser that is installed, of ujson and
+        simplejson, or else the standard library's json. Environment variable
+        SSM_JSON_PARSER names the parser to use instead (e.g., "json"). A
+        document the fast parser rejects is parsed again with json, so the
+        choice of parser never changes which files can be read.
+
+        Output is written with json, whose C encoder serializes the
+        unindented formats: third-party serializers format floats and
+        separators differently, and output must stay byte-for-byte what it
+        has been (the extractors' manifests hash it). Each writer keeps its
+        format, either the stages' plain json.dump format or the extractors'
+        sorted, indented (pretty) one, unless environment variable
+        SSM_COMPACT_JSON is true ("1", "t", "true", ...): then everything is
+        written in one compact, canonical format, with sorted keys and no
+        whitespace.
+"""
+
+import os
+import json
+
+ENCODING = "utf-8"
+
+# Parsers to try, fastest first:
+PARSERS = ("ujson", "simplejson", "json")
+PARSER_VAR = "SSM_JSON_PARSER"
+COMPACT_VAR = "SSM_COMPACT_JSON"
+
+
+def get_env_flag(name):
+    """ True if environment variable "name" is set to a true value.
+    """
+    return os.environ.get(name, "").lower() in ["1", "t", "true", "y", "yes"]
+
+
+def accepts_precise_float(module):
+    """ True if a ujson module has the precise_float option (1.x; 2.x always
+        parses floats precisely).
+    """
+    try:
+        module.loads("0", precise_float=True)
+    except TypeError:
+        return False
+    return True
+
+
+def get_parser(name=None):
+    """ Find a JSON parser.
+
+        Arg:
+            name: the module name of the parser to use (see PARSERS); by
+                default, the value of SSM_JSON_PARSER, or else the first of
+                PARSERS that is installed.
+
+        Returns:
+            a (name, loads) tuple, where loads parses a JSON string.
+    """
+    name = name or os.environ.get(PARSER_VAR)
+    for candidate in ([name] if name else PARSERS):
+        try:
+            module = __import__(candidate)
+        except ImportError:
+            continue
+        if candidate == "ujson" and accepts_precise_float(module):
+            # ujson 1.x's default float parsing can be off in the last digit:
+            return candidate, lambda s: module.loads(s, precise_float=True)
+        return candidate, module.loads
+    return "json", json.loads
+
+
+parser_name, parser_loads = get_parser()
+
+
+def load(path):
+    """ Load a JSON file, e.g., an SSM.
+
+        Arg:
+            path: path to the file.
+
+        Returns:
+            the document, with unicode strings (simplejson returns str for
+            ascii-only ones, which mix with unicode all the same).
+    """
+    with open(path) as f:
+        return loads(f.read())
+
+
+def loads(s):
+    """ Parse a JSON string, e.g., an SSM, as load() does.
+    """
+    if parser_loads is json.loads:
+        return json.loads(s)
+    try:
+        return parser_loads(s)
+    except ValueError:
+        return json.loads(s)
+
+
+def dumps(d, pretty=False, compact=None):
+    """ Serialize a document.
+
+        Args:
+            d: the document, e.g., an SSM dict.
+            pretty: if True, sort the keys and indent by 4, as the extractors
+                do; otherwise use json.dump's defaults, as the stages do.
+            compact: if True, use the compact, canonical format instead (see
+                module docstring); by default, the value of SSM_COMPACT_JSON.
+
+        Returns:
+            the JSON string.
+    """
+    if compact is None:
+        compact = get_env_flag(COMPACT_VAR)
+    if compact:
+        return json.dumps(d, sort_keys=True, separators=(",", ":"))
+    if pretty:
+        return json.dumps(d, sort_keys=True, indent=4)
+    return json.dumps(d)
+
+
+def dump(d, path, pretty=False, compact=None):
+    """ Write a document to a file, in the format of dumps().
+    """
+    with open(path, "w") as f:
+        f.write(dumps(d, pretty, compact))
+
+
+def text(s):
+    """ A str (e.g., a file name) as the unicode that document strings are.
+        Unicode is returned as it is.
+    """
+    if isinstance(s, str):
+        return s.decode(ENCODING)
+    return s
+
+
+def printable(value):
+    """ A value (a document string, or anything else) as a str that can be
+        printed whatever stdout's encoding: unicode is encoded as utf-8, and
+        anything else is passed through str().
+    """
+    if isinstance(value, unicode):
+        return value.encode(ENCODING)
+    return str(value)
@@ -9,7 +9,67 @@ import collections
 import json
 import string
 import re
+import time
+import datetime
+import heapq
+import threading
+import Queue
 import psycopg2
+import psycopg2.extensions
+
+# Columns of the "maps" table, in the order returned by "SELECT * from maps":
+MAPS_COLUMNS = ("id", "owner", "document", "created_at", "modified_at", "name")
+
+# Columns of a map summary row (see build_summary_query). "size" is the length
+# in bytes of the document as JSON text; "role" and "label" are text picked out
+# of the document; "document" is None when not requested:
+SUMMARY_COLUMNS = ("id", "owner", "modified_at", "name", "size", "role",
+                   "label", "document")
+
+# The "name" of the first node of a document for which node[key] == value
+# (bound in that order), or "no role" if there is none:
+ROLE_EXPRESSION = ("COALESCE((SELECT node->>'name' "
+                   "FROM jsonb_array_elements(document->'nodes') AS node "
+                   "WHERE node->>%s = %s LIMIT 1), 'no role')")
+
+# Rows fetched per network round trip by server-side cursors:
+DEFAULT_ITERSIZE = 2000
+
+# Keyword arguments of build_summary_query that are not selection criteria:
+SUMMARY_OPTIONS = ("role_key", "role_value", "label_key", "with_document",
+                   "order_by")
+
+# Environment variable that sets the default number of id ranges fetched
+# concurrently (see iter_partitioned), and the number of rows each range's
+# fetcher thread may run ahead:
+PARTITIONS_VAR = "SSM_PARTITIONS"
+PREFETCH_ROWS = 2 * DEFAULT_ITERSIZE
+
+# Name of the incremental extraction watermark file in an output directory:
+CHECKPOINT_FILE = ".ssm_checkpoint.json"
+
+# An incremental extraction reads again the maps modified in the
+# SSM_WATERMARK_LOOKBACK seconds before its watermark (see
+# get_incremental_start):
+WATERMARK_LOOKBACK_VAR = "SSM_WATERMARK_LOOKBACK"
+DEFAULT_WATERMARK_LOOKBACK = 600
+
+# A local snapshot of the "maps" and "users" tables (see snapshot_maps.py) is
+# used in place of the database when environment variable SSM_SNAPSHOT_DIR
+# names its directory and it is no more than SSM_SNAPSHOT_MAX_AGE hours old:
+SNAPSHOT_DIR_VAR = "SSM_SNAPSHOT_DIR"
+SNAPSHOT_MAX_AGE_VAR = "SSM_SNAPSHOT_MAX_AGE"
+DEFAULT_SNAPSHOT_MAX_AGE = 24
+SNAPSHOT_META_FILE = "snapshot.json"
+SNAPSHOT_MAPS_FILE = "maps.ndjson"
+SNAPSHOT_USERS_FILE = "users.ndjson"
+SNAPSHOT_DATETIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+# Date and timestamp formats accepted for "modified_since" and watermarks
+# (see parse_timestamp):
+TIMESTAMP_FORMATS = ("%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S",
+                     "%Y-%m-%d %H:%M:%S.%f", "%Y-%m-%d %H:%M:%S",
+                     "%Y-%m-%d %H:%M", "%Y-%m-%d")
 
 
 def connect():
@@ -44,14 +104,586 @@ def get_maps(sort_index):
         Returns:
             a sorted list of tuples.
     """
+    snapshot = get_snapshot_dir()
+    if snapshot is not None:
+        maps = iter_snapshot_rows(snapshot, SNAPSHOT_MAPS_FILE)
+        return sorted(maps, key=lambda k: k[sort_index])
+    sql, params = build_maps_query(order_by=MAPS_COLUMNS[sort_index])
+    return list(iter_rows(sql, params))
+
+
+def iter_rows(sql, params=None, itersize=DEFAULT_ITERSIZE,
+              unicode_text=False):
+    """ Run a query on a named (server-side) cursor and yield its rows as they
+        arrive, so that the full result set is never held in memory at once.
+
+        Args:
+            sql: the statement to execute, with %s placeholders.
+            params: the values to be bound to those placeholders.
+            itersize: the number of rows fetched per network round trip.
+            unicode_text: if True, text columns are returned as unicode (as
+                strings inside "document" are) rather than as str.
+
+        Returns:
+            a generator of tuples, one per row, in the order set by sql.
+    """
+    conn = connect()
+    cur = conn.cursor(name="ssm_processing")
+    cur.itersize = itersize
+    if unicode_text:
+        psycopg2.extensions.register_type(psycopg2.extensions.UNICODE, cur)
+    try:
+        cur.execute(sql, params)
+        for row in cur:
+            yield row
+    finally:
+        cur.close()
+        conn.close()
+
+
+def build_maps_predicate(version=None, state=None, has_key=None,
+                         exclude_owners=None, modified_since=None,
+                         id_range=None):
+    """ Translate map selection criteria into a SQL boolean expression on the
+        "document" JSON and the "owner" column of the "maps" table, so that
+        only matching rows leave the database server.
+
+        Args:
+            version: if not None, keep only maps whose document "version"
+                value (as text) equals this string.
+            state: if not None, keep only maps whose document "state" value
+                equals this string.
+            has_key: if not None, keep only maps whose document contains this
+                top-level key (e.g., "schoolLocation").
+            exclude_owners: if not empty, a list of owner ids whose maps are
+                to be left out. Maps with no owner are kept.
+            modified_since: if not None, a date or timestamp string; keep only
+                maps last modified at or after it.
+            id_range: if not None, a (low, high) tuple; keep only maps with
+                low <= id < high.
+
+        Returns:
+            a (predicate, params) tuple: "predicate" is either an empty string
+            (no criteria) or an expression with %s placeholders, and "params"
+            is the list of values to be bound to those placeholders.
+    """
+    clauses = []
+    params = []
+    if version is not None:
+        clauses.append("document->>'version' = %s")
+        params.append(str(version))
+    if state is not None:
+        clauses.append("document->>'state' = %s")
+        params.append(state)
+    if has_key is not None:
+        clauses.append("document ? %s")
+        params.append(has_key)
+    if exclude_owners:
+        clauses.append("(owner IS NULL OR owner <> ALL(%s))")
+        params.append(list(exclude_owners))
+    if modified_since is not None:
+        clauses.append("modified_at >= %s")
+        params.append(modified_since)
+    if id_range is not None:
+        clauses.append("id >= %s AND id < %s")
+        params.extend(id_range)
+    return " AND ".join(clauses), params
+
+
+def build_maps_filter(any_of=None, **criteria):
+    """ Build the WHERE clause for a maps query.
+
+        Args:
+            any_of: if not None, a list of criteria dicts (see
+                build_maps_predicate); a map is selected if it matches any one
+                of them. Otherwise the keyword arguments are the criteria.
+
+        Returns:
+            a (where, params) tuple: "where" is either an empty string or a
+            "WHERE ..." clause with %s placeholders, and "params" is the list
+            of values to be bound to those placeholders.
+    """
+    if any_of is None:
+        predicate, params = build_maps_predicate(**criteria)
+    else:
+        predicates = []
+        params = []
+        for spec in any_of:
+            spec_predicate, spec_params = build_maps_predicate(**spec)
+            if not spec_predicate:  # this one matches every map
+                return "", []
+            predicates.append("(" + spec_predicate + ")")
+            params.extend(spec_params)
+        predicate = " OR ".join(predicates)
+    if not predicate:
+        return "", []
+    return "WHERE " + predicate, params
+
+
+def map_matches(map, version=None, state=None, has_key=None,
+                exclude_owners=None, modified_since=None, id_range=None):
+    """ Test a row from the "maps" table against selection criteria on the
+        Python side, with the same meaning as the SQL built by
+        build_maps_predicate. Used where there is no database to evaluate
+        them, i.e., on a snapshot (see iter_snapshot_maps); rows fetched from
+        the database are routed on the flags it computes instead (see
+        build_routing_query).
+
+        Args:
+            map: a tuple with the layout of MAPS_COLUMNS.
+            (the rest): see build_maps_predicate.
+
+        Returns:
+            True if the map meets every criterion, False otherwise.
+    """
+    d = map[MAPS_COLUMNS.index("document")]
+    if version is not None and get_json_text(d, "version") != str(version):
+        return False
+    if state is not None and get_json_text(d, "state") != state:
+        return False
+    if has_key is not None and has_key not in d:
+        return False
+    owner = map[MAPS_COLUMNS.index("owner")]
+    if exclude_owners and owner in exclude_owners:
+        return False
+    modified_at = map[MAPS_COLUMNS.index("modified_at")]
+    if (modified_since is not None and
+            modified_at < parse_timestamp(modified_since)):
+        return False
+    if (id_range is not None and
+            not id_range[0] <= map[MAPS_COLUMNS.index("id")] < id_range[1]):
+        return False
+    return True
+
+
+def get_json_text(d, key):
+    """ The Python equivalent of the PostgreSQL expression document->>'key':
+        the value of top-level key "key" in d, rendered as unicode text, or
+        None if d has no such key or its value is null.
+    """
+    value = d.get(key)
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return u"true" if value else u"false"
+    if isinstance(value, (dict, list)):
+        return unicode(json.dumps(value))
+    return unicode(value)
+
+
+def parse_timestamp(value):
+    """ The Python equivalent of casting a date or timestamp string to a
+        PostgreSQL timestamp, as comparing it with "modified_at" does, e.g.,
+        "2018-1-5" or "2018-01-05 13:30:00". A datetime is returned as it is.
+
+        Raises:
+            ValueError if the string is in none of TIMESTAMP_FORMATS.
+    """
+    if isinstance(value, datetime.datetime):
+        return value
+    if isinstance(value, datetime.date):
+        return datetime.datetime.combine(value, datetime.time())
+    for fmt in TIMESTAMP_FORMATS:
+        try:
+            return datetime.datetime.strptime(value.strip(), fmt)
+        except ValueError:
+            pass
+    raise ValueError("unrecognized timestamp \"" + value + "\"")
+
+
+def build_maps_query(order_by="modified_at, id", any_of=None, **criteria):
+    """ Build a SELECT statement for the "maps" table that filters on
+        "criteria" (see build_maps_filter) and sorts in the database.
+
+        Args:
+            order_by: the ORDER BY expression; by default, ascending last
+                modified timestamp.
+
+        Returns:
+            a (sql, params) tuple ready for cursor.execute().
+    """
+    where, params = build_maps_filter(any_of, **criteria)
+    sql = "SELECT " + ", ".join(MAPS_COLUMNS) + " FROM maps"
+    if where:
+        sql += " " + where
+    sql += " ORDER BY " + order_by
+    return sql, params
+
+
+def iter_maps(itersize=DEFAULT_ITERSIZE, partitions=None, **criteria):
+    """ Stream from the PostgreSQL database (or from a fresh snapshot of it,
+        see get_snapshot_dir) the maps that match "criteria" (see
+        build_maps_filter and build_maps_predicate). Each tuple has the same
+        layout as a row of "SELECT * from maps" (see MAPS_COLUMNS).
+
+        Args:
+            itersize: the number of rows fetched per network round trip.
+            partitions: the number of id ranges to fetch concurrently, each
+                over its own connection (see iter_partitioned); by default
+                the value of environment variable SSM_PARTITIONS, or 1.
+
+        Returns:
+            a generator of tuples in ascending order of last modified
+            timestamp.
+    """
+    snapshot = get_snapshot_dir()
+    if snapshot is not None:
+        return iter_snapshot_maps(snapshot, **criteria)
+    if get_partition_count(partitions) > 1:
+        key_ixs = (MAPS_COLUMNS.index("modified_at"), MAPS_COLUMNS.index("id"))
+        return iter_partitioned(build_maps_query, key_ixs, itersize,
+                                get_partition_count(partitions), {}, criteria)
+    sql, params = build_maps_query(**criteria)
+    return iter_rows(sql, params, itersize)
+
+
+def select_maps(**criteria):
+    """ Get a list of tuples from the PostgreSQL database for only those maps
+        that match "criteria" (see build_maps_filter and
+        build_maps_predicate).
+
+        Returns:
+            a list of tuples in ascending order of last modified timestamp.
+    """
+    return list(iter_maps(**criteria))
+
+
+def build_summary_query(role_key=None, role_value=None, label_key=None,
+                        with_document=True, order_by="modified_at, id",
+                        any_of=None, **criteria):
+    """ Build a SELECT statement for the "maps" table that, in addition to
+        filtering on "criteria" (see build_maps_filter), computes in the
+        database what the extractors print and use to name files, and fetches
+        only the columns they need. See SUMMARY_COLUMNS for the row layout.
+
+        Args:
+            role_key, role_value: the "role" column is the "name" of the first
+                node for which node[role_key] == role_value (e.g., "shape" and
+                "circle"), or "no role" if there is none. If role_key is None
+                the column is NULL.
+            label_key: the "label" column is the text of the document's
+                top-level value for this key (e.g., "version"), or NULL.
+            with_document: if False, the "document" column is NULL, so that
+                listings and dry runs don't transfer whole maps.
+            order_by: the ORDER BY expression; by default, ascending last
+                modified timestamp.
+
+        Returns:
+            a (sql, params) tuple ready for cursor.execute().
+    """
+    params = []
+    if role_key is None:
+        role = "NULL"
+    else:
+        role = ROLE_EXPRESSION
+        params.extend([role_key, role_value])
+    if label_key is None:
+        label = "NULL"
+    else:
+        label = "document->>%s"
+        params.append(label_key)
+    columns = ["id", "owner", "modified_at", "name",
+               "octet_length(document::text)", role, label,
+               "document" if with_document else "NULL"]
+    where, where_params = build_maps_filter(any_of, **criteria)
+    sql = "SELECT " + ", ".join(columns) + " FROM maps"
+    if where:
+        sql += " " + where
+    sql += " ORDER BY " + order_by
+    return sql, params + where_params
+
+
+def iter_map_summaries(itersize=DEFAULT_ITERSIZE, partitions=None,
+                       **kwargs):
+    """ Stream map summary rows (see build_summary_query and SUMMARY_COLUMNS)
+        from the PostgreSQL database, or from a fresh snapshot of it (see
+        get_snapshot_dir). Text columns are unicode.
+
+        Args:
+            itersize: the number of rows fetched per network round trip.
+            partitions: the number of id ranges to fetch concurrently (see
+                iter_maps).
+
+        Returns:
+            a generator of tuples in ascending order of last modified
+            timestamp.
+    """
+    snapshot = get_snapshot_dir()
+    if snapshot is not None:
+        return iter_snapshot_summaries(snapshot, **kwargs)
+    if get_partition_count(partitions) > 1:
+        criteria = dict((k, v) for k, v in kwargs.iteritems()
+                        if k not in SUMMARY_OPTIONS)
+        options = dict((k, v) for k, v in kwargs.iteritems()
+                       if k in SUMMARY_OPTIONS)
+        key_ixs = (SUMMARY_COLUMNS.index("modified_at"),
+                   SUMMARY_COLUMNS.index("id"))
+        return iter_partitioned(build_summary_query, key_ixs, itersize,
+                                get_partition_count(partitions), options,
+                                criteria, unicode_text=True)
+    sql, params = build_summary_query(**kwargs)
+    return iter_rows(sql, params, itersize, unicode_text=True)
+
+
+def build_routing_query(any_of=None, roles=(), labels=(),
+                        order_by="modified_at, id"):
+    """ Build a SELECT statement for a combined extraction: fetch every map
+        that matches any of several sets of criteria, and have the database
+        say which ones each map matches, so that rows are routed by the very
+        predicates that selected them.
+
+        Args:
+            any_of: a list of criteria dicts (see build_maps_predicate).
+            roles: a list of (role_key, role_value) pairs; for each one, a
+                role column is computed as for build_summary_query.
+            labels: a list of label keys; for each one, a label column is
+                computed as for build_summary_query.
+            order_by: the ORDER BY expression; by default, ascending last
+                modified timestamp.
+
+        Returns:
+            a (sql, params) tuple ready for cursor.execute(). Each row holds
+            the columns of MAPS_COLUMNS, then one role column per pair in
+            roles, then one label column per key in labels, then one boolean
+            column per criteria dict in any_of, true if the map matches it.
+    """
+    columns = list(MAPS_COLUMNS)
+    params = []
+    for role_key, role_value in roles:
+        columns.append(ROLE_EXPRESSION)
+        params.extend([role_key, role_value])
+    for label_key in labels:
+        columns.append("document->>%s")
+        params.append(label_key)
+    for spec in any_of:
+        predicate, spec_params = build_maps_predicate(**spec)
+        if predicate:
+            # A NULL predicate (e.g., on a NULL owner) is not a match:
+            columns.append("COALESCE(" + predicate + ", FALSE)")
+        else:
+            columns.append("TRUE")
+        params.extend(spec_params)
+    where, where_params = build_maps_filter(any_of)
+    sql = "SELECT " + ", ".join(columns) + " FROM maps"
+    if where:
+        sql += " " + where
+    sql += " ORDER BY " + order_by
+    return sql, params + where_params
+
+
+def iter_routed_maps(any_of, roles=(), labels=(), itersize=DEFAULT_ITERSIZE,
+                     partitions=None):
+    """ Stream the rows of build_routing_query from the PostgreSQL database,
+        or from a fresh snapshot of it (see get_snapshot_dir). Text columns
+        are unicode.
+
+        Args:
+            any_of, roles, labels: see build_routing_query.
+            itersize: the number of rows fetched per network round trip.
+            partitions: the number of id ranges to fetch concurrently (see
+                iter_maps).
+
+        Returns:
+            a generator of tuples in ascending order of last modified
+            timestamp.
+    """
+    snapshot = get_snapshot_dir()
+    if snapshot is not None:
+        return iter_snapshot_routed_maps(snapshot, any_of, roles, labels)
+    if get_partition_count(partitions) > 1:
+        key_ixs = (MAPS_COLUMNS.index("modified_at"), MAPS_COLUMNS.index("id"))
+        return iter_partitioned(build_routing_query, key_ixs, itersize,
+                                get_partition_count(partitions),
+                                {"roles": roles, "labels": labels},
+                                {"any_of": any_of},
+                                unicode_text=True)
+    sql, params = build_routing_query(any_of, roles, labels)
+    return iter_rows(sql, params, itersize, unicode_text=True)
+
+
+def get_partition_count(partitions):
+    """ The number of id ranges to fetch concurrently: partitions if given,
+        otherwise the value of environment variable SSM_PARTITIONS, or 1.
+    """
+    if partitions is None:
+        partitions = int(os.environ.get(PARTITIONS_VAR) or 1)
+    return max(partitions, 1)
+
+
+def get_id_bounds(any_of=None, **criteria):
+    """ Get the smallest and largest ids of the maps that match the criteria
+        (see build_maps_filter).
+
+        Returns:
+            a (min, max) tuple, or (None, None) if no map matches.
+    """
+    where, params = build_maps_filter(any_of, **criteria)
+    sql = "SELECT min(id), max(id) FROM maps"
+    if where:
+        sql += " " + where
     conn = connect()
     cur = conn.cursor()
-    cur.execute("SELECT * from maps")
-    maps = cur.fetchall()
+    cur.execute(sql, params)
+    bounds = cur.fetchone()
     cur.close()
     conn.close()
-    #print "number of maps fetched: " + str(len(maps))
-    return sorted(maps, key=lambda k: k[sort_index])
+    return bounds
+
+
+def split_id_range(low, high, n):
+    """ Split the ids low..high (inclusive) into at most n contiguous,
+        half-open (start, stop) ranges of about equal width.
+    """
+    width = max((high - low + n) // n, 1)
+    return [(start, min(start + width, high + 1))
+            for start in range(low, high + 1, width)]
+
+
+def iter_partitioned(build_query, key_ixs, itersize, partitions, options,
+                     criteria, unicode_text=False):
+    """ Run one query per id range, concurrently and each over its own
+        connection, and merge their rows into the single sequence that one
+        serial query would have produced.
+
+        Every range is streamed by its own thread into a bounded queue; the
+        rows of each range are already sorted by (modified_at, id), so a
+        heap merge of the ranges on that key gives back the serial order.
+
+        Args:
+            build_query: build_maps_query or build_summary_query.
+            key_ixs: the (modified_at, id) column indices in its rows.
+            itersize: the number of rows fetched per network round trip.
+            partitions: the number of id ranges.
+            options: keyword arguments for build_query that are not criteria.
+            criteria: the selection criteria (see build_maps_filter).
+            unicode_text: see iter_rows.
+
+        Returns:
+            a generator of rows in ascending order of (modified_at, id).
+    """
+    low, high = get_id_bounds(**criteria)
+    if low is None:
+        return
+    streams = []
+    for id_range in split_id_range(low, high, partitions):
+        if criteria.get("any_of") is not None:
+            range_criteria = {"any_of": [dict(spec, id_range=id_range)
+                                         for spec in criteria["any_of"]]}
+        else:
+            range_criteria = dict(criteria, id_range=id_range)
+        sql, params = build_query(**dict(options, **range_criteria))
+        streams.append(iter_rows_in_thread(sql, params, itersize,
+                                           unicode_text))
+    ix_modified_at, ix_id = key_ixs
+    keyed = [((row[ix_modified_at], row[ix_id], row) for row in stream)
+             for stream in streams]
+    for key in heapq.merge(*keyed):
+        yield key[2]
+
+
+def iter_rows_in_thread(sql, params, itersize, unicode_text):
+    """ Start streaming the rows of a query (see iter_rows) on a background
+        thread, which runs ahead of the consumer by up to PREFETCH_ROWS rows.
+
+        Returns:
+            a generator of the rows. An error in the background thread is
+            raised from it.
+    """
+    rows = Queue.Queue(maxsize=PREFETCH_ROWS)
+    done = object()
+
+    def fetch():
+        try:
+            for row in iter_rows(sql, params, itersize, unicode_text):
+                rows.put(row)
+            rows.put(done)
+        except Exception as error:
+            rows.put(error)
+
+    fetcher = threading.Thread(target=fetch)
+    fetcher.daemon = True
+    fetcher.start()
+    return iter_queue(rows, done)
+
+
+def iter_queue(rows, done):
+    """ Yield the rows put on queue "rows" until the "done" marker arrives;
+        an exception put on the queue is raised instead.
+    """
+    while True:
+        row = rows.get()
+        if row is done:
+            return
+        if isinstance(row, Exception):
+            raise row
+        yield row
+
+
+def read_checkpoint(dir):
+    """ Read the incremental extraction watermark for an output directory.
+
+        Arg:
+            dir: path to a directory of extracted ssm files.
+
+        Returns:
+            a (modified_at, id) tuple for the last map written to dir, where
+            modified_at is an ISO 8601 string, or None if there is no
+            checkpoint yet.
+    """
+    path = os.path.join(dir, CHECKPOINT_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        checkpoint = json.load(f)
+    return (checkpoint["modified_at"], checkpoint["id"])
+
+
+def get_incremental_start(dir, lookback=None):
+    """ The "modified_since" bound of an incremental extraction into dir: the
+        timestamp of its checkpoint, less a lookback window. A map saved in a
+        transaction that commits late can carry an earlier "modified_at" than
+        maps that a previous run has already read, so a bound at the
+        checkpoint itself would miss it for good. The maps that are read
+        again cost little, since ssm_writer.MapWriter does not rewrite a map
+        whose content is unchanged.
+
+        Args:
+            dir: path to a directory of extracted ssm files.
+            lookback: the window, in seconds; by default the value of
+                environment variable SSM_WATERMARK_LOOKBACK, or
+                DEFAULT_WATERMARK_LOOKBACK.
+
+        Returns:
+            a datetime, or None if dir has no checkpoint yet.
+    """
+    checkpoint = read_checkpoint(dir)
+    if checkpoint is None:
+        return None
+    if lookback is None:
+        lookback = float(os.environ.get(WATERMARK_LOOKBACK_VAR) or
+                         DEFAULT_WATERMARK_LOOKBACK)
+    return (parse_timestamp(checkpoint[0]) -
+            datetime.timedelta(seconds=lookback))
+
+
+def write_checkpoint(dir, modified_at, map_id):
+    """ Record the incremental extraction watermark for an output directory.
+        The file is replaced atomically so that an interrupted run leaves the
+        previous checkpoint intact.
+
+        Args:
+            dir: path to a directory of extracted ssm files.
+            modified_at: datetime last modified timestamp of the last map
+                written to dir.
+            map_id: int id of that map.
+
+        Returns:
+            Nothing
+    """
+    path = os.path.join(dir, CHECKPOINT_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump({"modified_at": modified_at.isoformat(), "id": map_id}, f)
+    os.rename(path + ".tmp", path)
 
 
 def get_users(sort_index):
@@ -65,6 +697,10 @@ def get_users(sort_index):
         Returns:
             a sorted list of tuples.
     """
+    snapshot = get_snapshot_dir()
+    if snapshot is not None:
+        users = iter_snapshot_rows(snapshot, SNAPSHOT_USERS_FILE)
+        return sorted(users, key=lambda k: k[sort_index])
     conn = connect()
     cur = conn.cursor()
     cur.execute("SELECT * from users")
@@ -74,6 +710,148 @@ def get_users(sort_index):
     return sorted(users, key=lambda k: k[sort_index])
 
 
+def get_snapshot_dir():
+    """ Decide whether maps and users are to be read from a local snapshot
+        rather than from the database.
+
+        Returns:
+            the snapshot directory named by environment variable
+            SSM_SNAPSHOT_DIR, if it holds a snapshot taken no more than
+            SSM_SNAPSHOT_MAX_AGE (default 24) hours ago; otherwise None.
+    """
+    dir = os.environ.get(SNAPSHOT_DIR_VAR)
+    if not dir:
+        return None
+    meta = read_snapshot_meta(dir)
+    if meta is None:
+        return None
+    max_age = float(os.environ.get(SNAPSHOT_MAX_AGE_VAR) or
+                    DEFAULT_SNAPSHOT_MAX_AGE)
+    if time.time() - meta["taken_at"] > max_age * 3600:
+        return None
+    return dir
+
+
+def read_snapshot_meta(dir):
+    """ Read the freshness stamp of the snapshot in dir.
+
+        Returns:
+            a dict with (at least) key "taken_at", the snapshot time in
+            seconds since the epoch, or None if dir holds no snapshot.
+    """
+    path = os.path.join(dir, SNAPSHOT_META_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def encode_snapshot_value(value):
+    """ json.dumps "default" hook for table rows: datetimes become tagged
+        strings that decode_snapshot_row turns back into (naive) datetimes;
+        anything else JSON can't represent becomes its str().
+    """
+    if isinstance(value, datetime.datetime):
+        text = value.replace(tzinfo=None).strftime(SNAPSHOT_DATETIME_FORMAT)
+        return {"$datetime": text}
+    return str(value)
+
+
+def encode_snapshot_row(row):
+    """ Encode a table row as one line of NDJSON (without the newline).
+    """
+    return json.dumps(list(row), default=encode_snapshot_value)
+
+
+def decode_snapshot_row(line):
+    """ Decode a line written by encode_snapshot_row into a tuple shaped like
+        the row psycopg2 returned: datetimes are restored and top-level text
+        columns are (utf-8) str.
+    """
+    row = json.loads(line)
+    for i, value in enumerate(row):
+        if isinstance(value, dict) and value.keys() == ["$datetime"]:
+            row[i] = datetime.datetime.strptime(value["$datetime"],
+                                                SNAPSHOT_DATETIME_FORMAT)
+        elif isinstance(value, unicode):
+            row[i] = value.encode("utf-8")
+    return tuple(row)
+
+
+def iter_snapshot_rows(dir, fname):
+    """ Stream the rows of one table file of the snapshot in dir, in the
+        order in which they were written.
+    """
+    with open(os.path.join(dir, fname)) as f:
+        for line in f:
+            yield decode_snapshot_row(line)
+
+
+def iter_snapshot_maps(dir, any_of=None, **criteria):
+    """ The snapshot counterpart of iter_maps: stream the maps in the snapshot
+        in dir that match the criteria, tested with map_matches. The snapshot
+        holds the maps in ascending order of last modified timestamp.
+    """
+    specs = [criteria] if any_of is None else any_of
+    for map in iter_snapshot_rows(dir, SNAPSHOT_MAPS_FILE):
+        for spec in specs:
+            if map_matches(map, **spec):
+                yield map
+                break
+
+
+def iter_snapshot_summaries(dir, role_key=None, role_value=None,
+                            label_key=None, with_document=True,
+                            order_by=None, **criteria):
+    """ The snapshot counterpart of iter_map_summaries: compute in Python
+        what build_summary_query computes in the database.
+    """
+    for map in iter_snapshot_maps(dir, **criteria):
+        d = map[MAPS_COLUMNS.index("document")]
+        role = None
+        if role_key is not None:
+            role = get_snapshot_role(d, role_key, role_value)
+        label = None if label_key is None else get_json_text(d, label_key)
+        size = len(json.dumps(d, ensure_ascii=False).encode("utf-8"))
+        name = map[MAPS_COLUMNS.index("name")]
+        if name is not None:
+            name = name.decode("utf-8")
+        yield (map[MAPS_COLUMNS.index("id")],
+               map[MAPS_COLUMNS.index("owner")],
+               map[MAPS_COLUMNS.index("modified_at")],
+               name, size, role, label, d if with_document else None)
+
+
+def iter_snapshot_routed_maps(dir, any_of, roles=(), labels=()):
+    """ The snapshot counterpart of iter_routed_maps: compute in Python what
+        build_routing_query computes in the database.
+    """
+    for map in iter_snapshot_rows(dir, SNAPSHOT_MAPS_FILE):
+        matches = [map_matches(map, **spec) for spec in any_of]
+        if not any(matches):
+            continue
+        d = map[MAPS_COLUMNS.index("document")]
+        row = list(map)
+        name = row[MAPS_COLUMNS.index("name")]
+        if name is not None:
+            row[MAPS_COLUMNS.index("name")] = name.decode("utf-8")
+        row.extend(get_snapshot_role(d, role_key, role_value)
+                   for role_key, role_value in roles)
+        row.extend(get_json_text(d, label_key) for label_key in labels)
+        row.extend(matches)
+        yield tuple(row)
+
+
+def get_snapshot_role(d, role_key, role_value):
+    """ The Python equivalent of ROLE_EXPRESSION, for a snapshot document.
+    """
+    for node in d.get("nodes", []):
+        if get_json_text(node, role_key) == role_value:
+            name = get_json_text(node, "name")
+            return u"no role" if name is None else name
+    return u"no role"
+
+
 def get_file_list(dir, suffix):
     """ Get a list of all the files (in "dir") whose names end in "suffix."
         Note: copied and pasted from CMs_to_3cols.py. 2do: Tighten this up.
@@ -0,0 +1,279 @@
+#!/usr/bin/env python
+
+""" ssm_writer.py: Serialize and write extracted ssm .json files on a bounded
+    pool of background threads, so that the database cursor keeps streaming
+    while earlier maps are still being written.
+
+    Two environment variables control the writer:
+        SSM_WRITER_THREADS: the number of writer threads (default 4). 0 means
+            write each file in the calling thread, as the extractors used to.
+        SSM_COMPACT_JSON: if true ("1", "t", "true", ...), write compact JSON
+            (no indentation, no whitespace after separators). Otherwise write
+            the sorted, indented format the extractors have always produced.
+
+    Typical use:
+
+        with MapWriter() as writer:
+            for map in maps:
+                writer.write(path, d)
+        # every file is written here; any write error has been re-raised
+
+    Leaving the with block, also on an error, waits for every queued map
+    to be written before the manifests are updated.
+
+    When a map id is passed to write(), the file is tracked in a manifest,
+    .ssm_manifest.json, in its output directory. The manifest records the
+    path and the sha1 of the serialized (sorted-key) JSON of every map in the
+    directory. A map whose hash, path and file are unchanged since the last
+    run is not rewritten, so its mtime stays put and later stages of
+    runSSM.sh can skip it. Files are written to "<path>.tmp" and renamed
+    into place, and a map is recorded only once its file is, so a failed
+    write leaves both the old file and its old manifest entry. Each run also
+    records the ids it "added" and "changed" and, for a run that covers the
+    whole directory (full_run), the ids that were "removed", i.e., that are
+    in the manifest but were not written.
+"""
+
+import os
+import json
+import hashlib
+import datetime
+import threading
+import Queue
+import ssm_json
+from ssm_json import get_env_flag
+
+DEFAULT_THREADS = 4
+
+# Name of the content-hash manifest file in an output directory:
+MANIFEST_FILE = ".ssm_manifest.json"
+
+# Maps queued for writing, per thread, before write() blocks:
+PENDING_PER_THREAD = 16
+
+
+def get_env_int(name, default):
+    """ The integer value of environment variable "name", or default if it is
+        not set.
+    """
+    value = os.environ.get(name)
+    if value is None or value == "":
+        return default
+    return int(value)
+
+
+def dump_map(d, f, compact=False):
+    """ Write dict d to open file f as JSON with sorted keys, either indented
+        (the default) or compact.
+    """
+    f.write(dumps_map(d, compact))
+
+
+def dumps_map(d, compact=False):
+    """ Serialize dict d as dump_map does, and return the JSON string.
+    """
+    return ssm_json.dumps(d, pretty=True, compact=compact)
+
+
+def read_manifest(dir):
+    """ Read the content-hash manifest of an output directory.
+
+        Arg:
+            dir: path to a directory of extracted ssm files.
+
+        Returns:
+            the manifest dict, with keys "maps" (map id string -> {"path",
+            "hash"}), "added", "changed", "removed" (lists of int map ids
+            from the last run), "full_run" and "updated_at", or None if the
+            directory has no manifest yet.
+    """
+    path = os.path.join(dir, MANIFEST_FILE)
+    if not os.path.isfile(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_manifest(dir, manifest):
+    """ Replace the manifest of an output directory atomically, so that an
+        interrupted run leaves the previous manifest intact.
+    """
+    path = os.path.join(dir, MANIFEST_FILE)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f, sort_keys=True, indent=4)
+    os.rename(path + ".tmp", path)
+
+
+class MapWriter(object):
+    """ Writes dicts to .json files on a bounded pool of threads. Directories
+        are created once, the first time a file is written into them.
+    """
+
+    def __init__(self, threads=None, compact=None, full_run=True):
+        """ Args:
+                threads: number of writer threads; by default the value of
+                    SSM_WRITER_THREADS, or DEFAULT_THREADS.
+                compact: whether to write compact JSON; by default the value
+                    of SSM_COMPACT_JSON.
+                full_run: True if every map that belongs in the output
+                    directories will be written (so that the ones that were
+                    not have been removed), False for an incremental run.
+        """
+        if threads is None:
+            threads = get_env_int("SSM_WRITER_THREADS", DEFAULT_THREADS)
+        if compact is None:
+            compact = get_env_flag(ssm_json.COMPACT_VAR)
+        self.compact = compact
+        self.full_run = full_run
+        self.error = None
+        self.dirs = set()
+        self.dirs_lock = threading.Lock()
+        self.manifests = {}
+        self.queue = Queue.Queue(maxsize=max(threads, 1) * PENDING_PER_THREAD)
+        self.threads = []
+        for i in range(threads):
+            t = threading.Thread(target=self._work, name="MapWriter-" + str(i))
+            t.daemon = True
+            t.start()
+            self.threads.append(t)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        """ Write every queued map, then update the manifests (see close).
+            If the block raised, e.g., a database error partway through the
+            maps, the run is not a full run, since the maps after the error
+            were never queued, and the block's error is the one raised.
+        """
+        if exc_type is not None:
+            self.full_run = False
+        self.close(raise_error=exc_type is None)
+
+    def write(self, path, d, map_id=None):
+        """ Queue dict d to be written to path as JSON. Blocks if too many
+            maps are already waiting. Raises the first error met by any
+            writer thread so far.
+
+            If map_id is given, the file is tracked in the manifest of its
+            directory, and is not rewritten if its content is unchanged.
+        """
+        if self.error is not None:
+            raise self.error
+        if not self.threads:
+            self._write_file(path, d, map_id)
+        else:
+            self.queue.put((path, d, map_id))
+
+    def close(self, raise_error=True):
+        """ Wait until every queued map has been written, stop the writer
+            threads and update the manifests. Raises the first error met by
+            any writer thread.
+        """
+        for t in self.threads:
+            self.queue.put(None)
+        for t in self.threads:
+            t.join()
+        self.threads = []
+        self._write_manifests()
+        if raise_error and self.error is not None:
+            raise self.error
+
+    def _ensure_dir(self, dir):
+        with self.dirs_lock:
+            if dir not in self.dirs:
+                if not os.path.exists(dir):
+                    os.makedirs(dir)
+                self.dirs.add(dir)
+
+    def _write_file(self, path, d, map_id=None):
+        dir = os.path.dirname(path) or "."
+        self._ensure_dir(dir)
+        text = dumps_map(d, self.compact)
+        entry = None
+        if map_id is not None:
+            entry = {"path": os.path.basename(path),
+                     "hash": hashlib.sha1(text).hexdigest()}
+            if self._is_current(dir, str(map_id), entry, path):
+                return
+        # Write a temporary file and rename it into place, so that a failed
+        # write leaves the old file (if any) intact:
+        try:
+            with open(path + ".tmp", "w") as f:
+                f.write(text)
+            os.rename(path + ".tmp", path)
+        except Exception:
+            if os.path.exists(path + ".tmp"):
+                os.remove(path + ".tmp")
+            raise
+        if entry is not None:
+            self._track(dir, str(map_id), entry)
+
+    def _get_manifest(self, dir):
+        """ The manifest of dir for this run, read on first use. The caller
+            holds dirs_lock.
+        """
+        if dir not in self.manifests:
+            self.manifests[dir] = {
+                "old": (read_manifest(dir) or {}).get("maps", {}),
+                "maps": {}, "added": [], "changed": []
+            }
+        return self.manifests[dir]
+
+    def _is_current(self, dir, key, entry, path):
+        """ Returns True, and records the map in the manifest of dir, if the
+            file at path is already up to date.
+        """
+        with self.dirs_lock:
+            manifest = self._get_manifest(dir)
+            if manifest["old"].get(key) != entry or not os.path.isfile(path):
+                return False
+            manifest["maps"][key] = entry
+        return True
+
+    def _track(self, dir, key, entry):
+        """ Record a map in the manifest of dir once its file has been
+            written. A map whose write failed is never recorded, so it keeps
+            its entry from the last run, if any.
+        """
+        with self.dirs_lock:
+            manifest = self._get_manifest(dir)
+            manifest["maps"][key] = entry
+            if key in manifest["old"]:
+                manifest["changed"].append(int(key))
+            else:
+                manifest["added"].append(int(key))
+
+    def _write_manifests(self):
+        full_run = self.full_run and self.error is None
+        for dir, manifest in self.manifests.iteritems():
+            maps = manifest["maps"]
+            removed = []
+            for key, entry in manifest["old"].iteritems():
+                if key in maps:
+                    continue
+                if full_run:
+                    removed.append(int(key))
+                else:
+                    maps[key] = entry
+            write_manifest(dir, {
+                "updated_at": datetime.datetime.now().isoformat(),
+                "full_run": full_run,
+                "maps": maps,
+                "added": sorted(manifest["added"]),
+                "changed": sorted(manifest["changed"]),
+                "removed": sorted(removed)
+            })
+        self.manifests = {}
+
+    def _work(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            if self.error is not None:
+                continue  # drain the queue without writing
+            try:
+                self._write_file(*item)
+            except Exception as error:
+                self.error = error
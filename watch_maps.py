@@ -0,0 +1,304 @@
+#!/usr/bin/env python
+
+""" watch_maps.py: Keep a project directory up to date with the ssm database.
+    Wait for maps to be saved, then extract only the new and changed maps and
+    run the monodirectionalize and rlabel steps of runSSM.sh on only those,
+    so that results for a newly submitted map are ready within a minute or so
+    rather than after the next batch run.
+
+    Usage:
+        watch_maps.py project_directory [once]
+
+    Args:
+        project_directory: the directory to keep up to date. It gets the same
+        layout runSSM.sh uses:
+            0-ssm: the extracted maps, named as by get_maps.py, with the
+                incremental checkpoint (see ssm_utilities.CHECKPOINT_FILE)
+                and manifest (see ssm_writer.MANIFEST_FILE) of the extraction.
+            1-ssm-monodir: the monodirectionalized maps.
+            2-ssm-monodir-rlabeled: the rlabeled maps (rlabels built from the
+                full file name, as runSSM.sh does).
+        Directories that don't exist are created.
+        once (optional): Boolean. If true, bring the directory up to date
+        once and exit, instead of watching. Default is False.
+
+    Each pass extracts the maps saved since the checkpoint of the previous
+    pass, reading again those saved in the SSM_WATERMARK_LOOKBACK seconds
+    (default 600) before it, so that a map whose transaction committed late
+    is not missed. Then it (re)processes every map whose monodirectionalized
+    or rlabeled file is missing or older than its input. Since the extractor
+    leaves files of unchanged maps untouched, only new and changed maps are
+    processed, and a pass that was interrupted is caught up by the next one.
+    Monodirectionalized and rlabeled files whose input is gone (e.g., the
+    file of a map extracted under a new name, see get_maps.remove_stale_files)
+    are deleted.
+
+    Between passes, the daemon LISTENs on PostgreSQL notification channel
+    SSM_NOTIFY_CHANNEL (default "ssm_maps_changed") and starts a pass as soon
+    as a notification arrives, after waiting SSM_NOTIFY_DELAY seconds (default
+    2) so that a burst of saves is handled in one pass. In any case a pass is
+    started every SSM_POLL_SECONDS seconds (default 60), so that without the
+    trigger, or with the listening connection lost, changes are still picked
+    up by polling the "modified_at" watermark. To have the database notify
+    the daemon, install this trigger:
+
+        CREATE OR REPLACE FUNCTION notify_ssm_maps_changed() RETURNS trigger
+        AS $$
+        BEGIN
+            PERFORM pg_notify('ssm_maps_changed', NEW.id::text);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        CREATE TRIGGER ssm_maps_changed AFTER INSERT OR UPDATE ON maps
+            FOR EACH ROW EXECUTE PROCEDURE notify_ssm_maps_changed();
+
+    To try it against a local PostgreSQL server, point ssm_utilities.connect()
+    at it (e.g., with the PGHOST, PGPORT, PGDATABASE and PGUSER environment
+    variables), install the trigger, start the daemon and insert or update a
+    row of "maps".
+
+    The daemon always reads the database, never a snapshot (see
+    snapshot_maps.py).
+"""
+
+import sys
+import os
+import time
+import select
+import psycopg2
+from ssm_utilities import SUMMARY_COLUMNS, connect, iter_rows, \
+    build_summary_query, get_incremental_start, write_checkpoint, \
+    get_file_list, build_path_list
+from ssm_writer import MapWriter, get_env_int
+import get_maps
+import monodirectionalize_SSM_edges
+import add_rlabels_to_SSMs
+
+# Rlabels are built from the full file name, as runSSM.sh builds them:
+RLABEL_OPTIONS = add_rlabels_to_SSMs.RlabelOptions(use_full_filename=True,
+                                                   undir=False,
+                                                   plain_names=False)
+
+DEFAULT_CHANNEL = "ssm_maps_changed"
+DEFAULT_POLL_SECONDS = 60
+DEFAULT_NOTIFY_DELAY = 2
+
+SSM_SUBDIR = "0-ssm"
+MONODIR_SUBDIR = "1-ssm-monodir"
+RLABELED_SUBDIR = "2-ssm-monodir-rlabeled"
+
+IX_SSM_ID = SUMMARY_COLUMNS.index("id")
+IX_MODIFIED_AT = SUMMARY_COLUMNS.index("modified_at")
+IX_ROLE = SUMMARY_COLUMNS.index("role")
+IX_LABEL = SUMMARY_COLUMNS.index("label")
+IX_DOC = SUMMARY_COLUMNS.index("document")
+
+
+def extract_changed_maps(dir):
+    """ Extract into dir, named as by get_maps.py, the maps saved since its
+        checkpoint, less the lookback window (see
+        ssm_utilities.get_incremental_start), and advance the checkpoint.
+
+        Arg:
+            dir: the directory of extracted maps.
+
+        Returns:
+            the number of maps fetched.
+    """
+    since = get_incremental_start(dir)
+    sql, params = build_summary_query(role_key="type", role_value="role",
+                                      label_key="version",
+                                      modified_since=since)
+    with MapWriter(full_run=False) as writer:
+        files = get_maps.build_map_file_index(dir)
+        n = 0
+        last = None
+        for map in iter_rows(sql, params, unicode_text=True):
+            vrsn = str(map[IX_LABEL] or "no version")
+            get_maps.write_map_to_file(writer, files, dir, vrsn, map[IX_ROLE],
+                                       map[IX_SSM_ID], map[IX_DOC])
+            n += 1
+            last = map
+    if last is not None:
+        write_checkpoint(dir, last[IX_MODIFIED_AT], last[IX_SSM_ID])
+    return n
+
+
+def get_map_files(dir):
+    """ The names of the ssm .json files in dir, leaving out the hidden
+        checkpoint and manifest files.
+    """
+    if not os.path.isdir(dir):
+        return []
+    return sorted(fn for fn in get_file_list(dir, ".json")
+                  if not fn.startswith("."))
+
+
+def is_stale(inpath, outpath):
+    """ True if outpath doesn't exist or is older than inpath.
+    """
+    return (not os.path.exists(outpath) or
+            os.path.getmtime(outpath) < os.path.getmtime(inpath))
+
+
+def process_stale_maps(indir, outdir, build_outpaths, process):
+    """ Run one processing step on the maps in indir whose output in outdir
+        is missing or out of date, and delete the outputs in outdir that no
+        longer have an input in indir.
+
+        Args:
+            indir: the input directory of the step.
+            outdir: the output directory of the step.
+            build_outpaths: the step's function that maps a list of input file
+                names to a list of output paths.
+            process: the step's function that processes one map, given its
+                input and output paths.
+
+        Returns:
+            a (processed, removed) tuple of the numbers of maps processed and
+            of outputs deleted.
+    """
+    if not os.path.exists(outdir):
+        os.makedirs(outdir)
+    infiles = get_map_files(indir)
+    inpaths = build_path_list(indir, infiles)
+    outpaths = build_outpaths(infiles, outdir)
+    n = 0
+    for inpath, outpath in zip(inpaths, outpaths):
+        if is_stale(inpath, outpath):
+            process(inpath, outpath)
+            n += 1
+    return n, remove_orphaned_outputs(outdir, outpaths)
+
+
+def remove_orphaned_outputs(outdir, outpaths):
+    """ Delete the ssm files in outdir that are not in outpaths, i.e., that
+        no longer have an input.
+
+        Returns:
+            the number of files deleted.
+    """
+    expected = set(os.path.basename(path) for path in outpaths)
+    n = 0
+    for fn in get_map_files(outdir):
+        if fn not in expected:
+            os.remove(os.path.join(outdir, fn))
+            n += 1
+    return n
+
+
+def rlabel_single_ssm(inpath, outpath):
+    """ Rlabel one map, with RLABEL_OPTIONS.
+    """
+    add_rlabels_to_SSMs.add_rlabels_to_single_ssm(inpath, outpath,
+                                                  RLABEL_OPTIONS)
+
+
+def run_pass(project_dir):
+    """ Bring a project directory up to date (see module docstring).
+    """
+    ssm_dir = os.path.join(project_dir, SSM_SUBDIR)
+    monodir_dir = os.path.join(project_dir, MONODIR_SUBDIR)
+    rlabeled_dir = os.path.join(project_dir, RLABELED_SUBDIR)
+    n = extract_changed_maps(ssm_dir)
+    n_monodir, removed_monodir = process_stale_maps(
+        ssm_dir, monodir_dir,
+        monodirectionalize_SSM_edges.build_monodirectionalized_ssm_path_list,
+        monodirectionalize_SSM_edges.monodirectionalize_single_ssm)
+    n_rlabeled, removed_rlabeled = process_stale_maps(
+        monodir_dir, rlabeled_dir,
+        add_rlabels_to_SSMs.build_rlabeled_ssm_path_list, rlabel_single_ssm)
+    print (time.strftime("%Y-%m-%d %H:%M:%S") + ": " + str(n) +
+           " maps fetched, " + str(n_monodir) + " monodirectionalized, " +
+           str(n_rlabeled) + " rlabeled, " +
+           str(removed_monodir + removed_rlabeled) + " outdated files removed")
+
+
+def open_listener(channel):
+    """ Open a connection that LISTENs on a notification channel.
+
+        Returns:
+            the connection, or None if it couldn't be opened (in which case
+            the daemon falls back to polling).
+    """
+    conn = connect()
+    if conn is None:
+        return None
+    try:
+        conn.autocommit = True
+        cur = conn.cursor()
+        cur.execute("LISTEN " + channel)
+        cur.close()
+    except (Exception, psycopg2.DatabaseError) as error:
+        print error
+        conn.close()
+        return None
+    return conn
+
+
+def wait_for_notification(listener, timeout):
+    """ Wait up to timeout seconds for a notification on listener, then
+        discard any that arrived.
+
+        Returns:
+            True if a notification arrived.
+    """
+    if select.select([listener], [], [], timeout) == ([], [], []):
+        return False
+    listener.poll()
+    notified = len(listener.notifies) > 0
+    del listener.notifies[:]
+    return notified
+
+
+def wait_for_change(listener, poll_seconds, notify_delay):
+    """ Wait for a notification or until the poll interval is up, whichever
+        comes first.
+
+        Returns:
+            the listener, or None if it has been lost.
+    """
+    if listener is None:
+        time.sleep(poll_seconds)
+        return None
+    deadline = time.time() + poll_seconds
+    try:
+        while time.time() < deadline:
+            if wait_for_notification(listener, deadline - time.time()):
+                time.sleep(notify_delay)
+                wait_for_notification(listener, 0)
+                break
+    except (Exception, psycopg2.DatabaseError) as error:
+        print error
+        listener.close()
+        return None
+    return listener
+
+
+def main():
+    if len(sys.argv) < 2:
+        print "usage: watch_maps.py project_directory [once]"
+        return
+    project_dir = sys.argv[1]
+    once = (len(sys.argv) > 2 and
+            sys.argv[2] in ['t', 'T', "TRUE", "true", "True"])
+    channel = os.environ.get("SSM_NOTIFY_CHANNEL") or DEFAULT_CHANNEL
+    poll_seconds = get_env_int("SSM_POLL_SECONDS", DEFAULT_POLL_SECONDS)
+    notify_delay = get_env_int("SSM_NOTIFY_DELAY", DEFAULT_NOTIFY_DELAY)
+    listener = None
+    while True:
+        if not once and listener is None:
+            # Listen before the pass, so no change during it is missed:
+            listener = open_listener(channel)
+        try:
+            run_pass(project_dir)
+        except (Exception, psycopg2.DatabaseError) as error:
+            print error
+        if once:
+            return
+        listener = wait_for_change(listener, poll_seconds, notify_delay)
+
+
+if __name__ == "__main__":
+    main()